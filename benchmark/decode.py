@@ -0,0 +1,111 @@
+"""Benchmark of the decoding of values.get responses into a polars DataFrame,
+comparing json.loads into python lists with the incremental Arrow decoder used
+with STREAM_DECODE. Payloads are raw response bodies fetched with
+majorDimension=COLUMNS, recorded from the API or generated with FakeSheetsService.
+
+    python -m benchmark.decode --generate 100000 --output benchmark/results/payload-100000.json
+    python -m benchmark.decode benchmark/results/payload-100000.json
+
+Every path runs in its own process so peak memory is measured independently."""
+import sys
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+
+from benchmark.process import run_in_process
+
+
+def decode_json(content: bytes):
+    import polars as pl
+
+    values = json.loads(content).get('values', [])
+    height = max((len(column) for column in values), default=0)
+    return pl.DataFrame([pl.Series(f'c{idx}', column + [None] * (height - len(column)), dtype=pl.Utf8)
+                         for idx, column in enumerate(values)])
+
+
+def decode_arrow(content: bytes):
+    import polars as pl
+    import pyarrow as pa
+    from etl.google_sheets.arrow_decoder import decode_columns
+
+    columns = decode_columns(content)
+    height = max((len(column) for column in columns), default=0)
+    return pl.DataFrame([pl.Series(f'c{idx}', column if len(column) == height
+                                   else pa.concat_arrays([column, pa.nulls(height - len(column), column.type)]))
+                         for idx, column in enumerate(columns)])
+
+
+DECODERS = {'json': decode_json, 'arrow': decode_arrow}
+
+
+def run_decoder(path: str, decoder: str, queue: multiprocessing.Queue) -> None:
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    start = time.perf_counter()
+    df = DECODERS[decoder](content)
+    seconds = time.perf_counter() - start
+
+    queue.put({
+        'payload': path,
+        'decoder': decoder,
+        'payload_mb': len(content) / 1024 ** 2,
+        'rows': df.height,
+        'seconds': seconds,
+        # ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def generate(rows: int, output: str) -> None:
+    from benchmark.fake_sheets import FakeSheetsService
+
+    service = FakeSheetsService()
+    service.add_spreadsheet('payload', 1, rows)
+    title = service.get_sheets('payload')[0]['properties']['title']
+    with open(output, 'w') as f:
+        json.dump({'values': service.get_range_values('payload', f'{title}!A:G')}, f)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark of the decoding of Sheets responses')
+    parser.add_argument('payloads', nargs='*', help='recorded values.get response bodies')
+    parser.add_argument('--decoders', default='json,arrow')
+    parser.add_argument('--generate', type=int, default=None,
+                        help='rows of a synthetic payload to write to --output')
+    parser.add_argument('--output', default=None)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    if args.generate is not None:
+        if args.output is None:
+            sys.exit('--output is required with --generate')
+        generate(args.generate, args.output)
+        return
+
+    results = []
+
+    for path in args.payloads:
+        for decoder in args.decoders.split(','):
+            result, exitcode = run_in_process(run_decoder, path, decoder)
+            if exitcode != 0 or result is None:
+                print(f'{path} {decoder}: failed with exit code {exitcode}', file=sys.stderr)
+                continue
+
+            results.append(result)
+            print(f"{path} {decoder}: {result['rows']} rows from {result['payload_mb']:.1f} MB"
+                  f" in {result['seconds']:.2f}s, peak {result['peak_rss_mb']:.0f} MB")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
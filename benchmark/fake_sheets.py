@@ -0,0 +1,132 @@
+import re
+import time
+import json
+import hashlib
+import threading
+from datetime import datetime as dt, timedelta
+
+
+class FakeRequest():
+
+    def __init__(self, service: 'FakeSheetsService', fn) -> None:
+        self.service = service
+        self.fn = fn
+        self.postproc = None
+
+    def execute(self, http=None, num_retries: int=0):
+        if self.service.latency > 0:
+            time.sleep(self.service.latency)
+        with self.service._lock:
+            self.service.calls += 1
+        if self.postproc is not None:
+            # like HttpRequest, postproc gets the serialized response body
+            return self.postproc(None, json.dumps(self.fn()).encode())
+        return self.fn()
+
+
+class FakeValues():
+
+    def __init__(self, service: 'FakeSheetsService') -> None:
+        self.service = service
+
+    def get(self, spreadsheetId: str, range: str, majorDimension: str='COLUMNS', fields: str=None,
+            **render_options):
+        return FakeRequest(self.service,
+                           lambda: {'values': self.service.get_range_values(spreadsheetId, range)})
+
+    def batchGet(self, spreadsheetId: str, ranges: list[str], majorDimension: str='COLUMNS',
+                 fields: str=None, **render_options):
+        return FakeRequest(self.service,
+                           lambda: {'valueRanges': [{'values': self.service.get_range_values(spreadsheetId, range)}
+                                                    for range in ranges]})
+
+
+class FakeSpreadsheets():
+
+    def __init__(self, service: 'FakeSheetsService') -> None:
+        self.service = service
+
+    def get(self, spreadsheetId: str, fields: str=None):
+        return FakeRequest(self.service, lambda: {'sheets': self.service.get_sheets(spreadsheetId)})
+
+    def values(self) -> FakeValues:
+        return FakeValues(self.service)
+
+
+class FakeHttp():
+    credentials = None
+
+
+class FakeSheetsService():
+    """In memory stand in for the Sheets v4 Resource serving synthetic form
+    responses. Only the calls made by the ETL are implemented. It also works as a
+    RevisionSource for change detection"""
+
+    HEADER = ['Marca temporal', 'Puntuación', 'Dirección de correo electrónico', 'Nombres',
+              'Apellidos', 'DNI', 'Teléfono']
+    RANGE_PATTERN = re.compile(r'^([A-Za-z]+)(\d*):([A-Za-z]+)(\d*)$')
+
+    def __init__(self, latency: float=0.0) -> None:
+        self.latency = latency
+        self.calls = 0
+        self._http = FakeHttp()
+        self._spreadsheets: dict[str, dict[str, list[list[str]]]] = {}
+        self._lock = threading.Lock()
+
+    def spreadsheets(self) -> FakeSpreadsheets:
+        return FakeSpreadsheets(self)
+
+    def add_spreadsheet(self, spreadsheet_id: str, pages: int, rows_per_page: int,
+                        start: dt=dt(2023, 1, 1)) -> None:
+        self._spreadsheets[spreadsheet_id] = {}
+        for page_idx in range(pages):
+            title = f'Grupo {page_idx + 1}'
+            self._spreadsheets[spreadsheet_id][title] = [[header] for header in self.HEADER]
+            self.append_rows(spreadsheet_id, title, rows_per_page, start)
+
+    def append_rows(self, spreadsheet_id: str, title: str, rows: int, start: dt=None) -> None:
+        columns = self._spreadsheets[spreadsheet_id][title]
+        offset = len(columns[0]) - 1
+        start = start if start is not None else dt(2023, 1, 1) + timedelta(seconds=offset)
+
+        for row_idx in range(offset, offset + rows):
+            timestamp = start + timedelta(seconds=row_idx - offset)
+            row = [timestamp.strftime('%d/%m/%Y %H:%M:%S'),
+                   f'{row_idx % 21} / 20',
+                   f'user{row_idx}@example.com',
+                   f'Nombre {row_idx}',
+                   f'Apellido {row_idx}',
+                   f'{10000000 + row_idx:08d}',
+                   f'9{row_idx % 100:02d} {row_idx % 1000:03d} {row_idx % 1000:03d}']
+            for column, value in zip(columns, row):
+                column.append(value)
+
+    def get_sheets(self, spreadsheet_id: str) -> list[dict]:
+        return [{'properties': {'sheetId': idx,
+                                'title': title,
+                                'gridProperties': {'rowCount': len(columns[0])}}}
+                for idx, (title, columns) in enumerate(self._spreadsheets[spreadsheet_id].items())]
+
+    def get_range_values(self, spreadsheet_id: str, range: str) -> list[list[str]]:
+        title, cells = range.rsplit('!', 1)
+        first_column, first_row, last_column, last_row = self.RANGE_PATTERN.match(cells).groups()
+        columns = self._spreadsheets[spreadsheet_id][title.strip("'")]
+
+        start = int(first_row) - 1 if first_row else 0
+        end = int(last_row) if last_row else None
+        first = self._column_index(first_column)
+        last = self._column_index(last_column)
+
+        values = [column[start:end] for column in columns[first:last + 1]]
+        return [column for column in values if len(column) > 0]
+
+    def get_revision(self, google_sheets_file_id: str) -> str:
+        grid = [(sheet['properties']['title'], sheet['properties']['gridProperties']['rowCount'])
+                for sheet in self.get_sheets(google_sheets_file_id)]
+        return hashlib.sha1(json.dumps(grid).encode()).hexdigest()
+
+    def _column_index(self, column: str) -> int:
+        idx = 0
+        for char in column.upper():
+            idx = idx * 26 + ord(char) - ord('A') + 1
+        return idx - 1
@@ -0,0 +1,169 @@
+"""Multi process check of TableLease against a MySQL database. Several worker
+processes race to claim the same tables and the harness verifies:
+
+    - no table is claimed by two owners at once
+    - leases left behind by dead workers are reclaimed once they expire, and the
+      previous owners can no longer renew them
+    - tables completed within the refresh interval are not claimed again
+
+    python -m benchmark.leases --processes 8 --tables 50 --rounds 5
+
+The database is taken from BENCHMARK_DB_HOST, BENCHMARK_DB_USER,
+BENCHMARK_DB_PASSWORD and BENCHMARK_DB_DATABASE. Leases are kept in
+BENCHMARK_LEASE_TABLE, bench_lease by default, which is recreated."""
+import os
+import sys
+import time
+import queue
+import argparse
+import multiprocessing
+
+from benchmark.run import build_datasource
+
+
+LEASE_TABLE = os.getenv('BENCHMARK_LEASE_TABLE', 'bench_lease')
+
+
+def table_names(tables: int) -> list[str]:
+    return [f'bench_table_{idx}' for idx in range(tables)]
+
+
+def claim_tables(owner: str, offset: int, tables: int, lease_seconds: int, refresh_seconds: int,
+                 barrier, result_queue: multiprocessing.Queue) -> None:
+    """Tries to claim every table once, starting together with the other workers,
+    and exits without releasing what it got, like a worker that died"""
+    os.environ['LEASE_TABLE'] = LEASE_TABLE
+    from util.lease import TableLease
+
+    datasource = build_datasource()
+    db_tables = table_names(tables)
+    # workers walk the tables from different offsets, as GoogleSheetsWorker does
+    db_tables = db_tables[offset:] + db_tables[:offset]
+
+    barrier.wait()
+    claimed = []
+    for db_table in db_tables:
+        with datasource.transaction() as conn:
+            if TableLease.claim(conn, db_table, owner, lease_seconds, refresh_seconds):
+                claimed.append(db_table)
+
+    datasource.dispose()
+    result_queue.put((owner, claimed))
+
+
+def run_claims(round_name: str, processes: int, tables: int, lease_seconds: int,
+               refresh_seconds: int) -> dict[str, list[str]]:
+    """Starts processes workers claiming the tables at once and returns the owners of every table.
+    Leases must outlast the round, otherwise tables are rightfully claimed twice"""
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    barrier = context.Barrier(processes)
+    workers = [context.Process(target=claim_tables,
+                               args=(f'{round_name}-worker-{idx}', idx * tables // processes, tables,
+                                     lease_seconds, refresh_seconds, barrier, result_queue))
+               for idx in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    # results are read before joining, so no worker blocks flushing them
+    owners_by_table: dict[str, list[str]] = {}
+    for _ in workers:
+        try:
+            owner, claimed = result_queue.get(timeout=max(60, lease_seconds * 4))
+        except queue.Empty:
+            for worker in workers:
+                worker.terminate()
+            raise Exception(f'{round_name}: workers did not report their claims')
+        for db_table in claimed:
+            owners_by_table.setdefault(db_table, []).append(owner)
+
+    for worker in workers:
+        worker.join()
+        if worker.exitcode != 0:
+            raise Exception(f'{round_name}: a worker failed with exit code {worker.exitcode}')
+    return owners_by_table
+
+
+def check_exclusive(round_name: str, owners_by_table: dict[str, list[str]], tables: int) -> list[str]:
+    errors = [f'{round_name}: table {db_table} claimed by {", ".join(owners)}'
+              for db_table, owners in owners_by_table.items() if len(owners) > 1]
+    unclaimed = [db_table for db_table in table_names(tables) if db_table not in owners_by_table]
+    if len(unclaimed) > 0:
+        errors.append(f'{round_name}: {len(unclaimed)} tables were not claimed by anyone')
+    return errors
+
+
+def run_round(round_idx: int, args: argparse.Namespace) -> list[str]:
+    from util.lease import TableLease
+
+    datasource = build_datasource()
+    with datasource as conn:
+        conn.execute(f'DELETE FROM {TableLease.TABLE}')
+        conn.commit()
+
+    errors = []
+
+    # every table is free, each one must go to exactly one worker
+    first_owners = run_claims(f'round{round_idx}-claim', args.processes, args.tables,
+                              args.lease_seconds, args.refresh_seconds)
+    errors += check_exclusive(f'round {round_idx} claim', first_owners, args.tables)
+
+    # the workers exited holding their leases, they are reclaimed once expired
+    time.sleep(args.lease_seconds + 1)
+    second_owners = run_claims(f'round{round_idx}-reclaim', args.processes, args.tables,
+                               args.lease_seconds, args.refresh_seconds)
+    errors += check_exclusive(f'round {round_idx} reclaim', second_owners, args.tables)
+
+    with datasource.transaction() as conn:
+        for db_table, owners in first_owners.items():
+            if TableLease.heartbeat(conn, db_table, owners[0], args.lease_seconds):
+                errors.append(f'round {round_idx}: expired lease of {db_table} renewed by {owners[0]}')
+
+    # completed tables are left alone within the refresh interval, even once the lease expired
+    with datasource.transaction() as conn:
+        for db_table, owners in second_owners.items():
+            TableLease.release(conn, db_table, owners[0], True)
+    completed_owners = run_claims(f'round{round_idx}-completed', args.processes, args.tables,
+                                  args.lease_seconds, args.refresh_seconds)
+    errors += [f'round {round_idx}: completed table {db_table} claimed again by {", ".join(owners)}'
+               for db_table, owners in completed_owners.items()]
+
+    datasource.dispose()
+    return errors
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Multi process check of the table leases')
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--tables', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--lease-seconds', type=int, default=10)
+    parser.add_argument('--refresh-seconds', type=int, default=600)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    os.environ['LEASE_TABLE'] = LEASE_TABLE
+    from util.lease import TableLease
+
+    datasource = build_datasource()
+    with datasource as conn:
+        conn.execute(f'DROP TABLE IF EXISTS {TableLease.TABLE}')
+        TableLease.create_table(conn)
+    datasource.dispose()
+
+    errors = []
+    for round_idx in range(args.rounds):
+        round_errors = run_round(round_idx, args)
+        print(f'round {round_idx}: {args.processes} processes, {args.tables} tables,'
+              f' {len(round_errors)} violations')
+        errors += round_errors
+
+    for error in errors:
+        print(error, file=sys.stderr)
+    sys.exit(1 if len(errors) > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+import queue
+import multiprocessing
+
+
+def run_in_process(target, *args) -> tuple[object, int]:
+    """Runs target(*args, queue) in a spawned process and returns the result it
+    put in the queue, None if it put nothing, along with the exit code. The
+    result is read before joining, a child blocked flushing a large result to
+    the pipe would never exit otherwise"""
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=target, args=(*args, result_queue))
+    process.start()
+
+    result = None
+    while True:
+        try:
+            result = result_queue.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                # the result may have been flushed right before the process exited
+                try:
+                    result = result_queue.get(timeout=1)
+                except queue.Empty:
+                    pass
+                break
+
+    process.join()
+    return result, process.exitcode
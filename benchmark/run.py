@@ -0,0 +1,247 @@
+"""Offline benchmark of the ETL. Serves synthetic form responses through
+FakeSheetsService and loads them into a local MySQL database, reporting
+per stage timings, rows/s and peak memory for every scenario as JSON.
+
+    python -m benchmark.run --rows 1000,100000 --modes historical,incremental
+    python -m benchmark.run --compare benchmark/results/<previous>.json
+
+The database is taken from BENCHMARK_DB_HOST, BENCHMARK_DB_USER,
+BENCHMARK_DB_PASSWORD and BENCHMARK_DB_DATABASE. Every scenario runs in its
+own process so peak memory is measured independently, after the tables are
+seeded in another one."""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+from datetime import datetime as dt
+
+from benchmark.process import run_in_process
+
+
+TABLE_DDL = """CREATE TABLE {db_table} (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    marca_temporal DATETIME,
+    puntuacion TINYINT UNSIGNED,
+    correo VARCHAR(255),
+    nombres VARCHAR(255),
+    apellidos VARCHAR(255),
+    dni VARCHAR(20),
+    telefono VARCHAR(20),
+    pestania VARCHAR(255),
+    link_pestania VARCHAR(255),
+    link_wordpress VARCHAR(255),
+    seminario VARCHAR(255),
+    estado VARCHAR(20),
+    INDEX (pestania, marca_temporal, correo)
+);
+"""
+
+
+def build_config(scenario: dict) -> dict:
+    return {
+        'common_metadata': {'excluded_columns': []},
+        'google_sheets_files_metadata': [
+            {'id': f'bench-file-{idx}',
+             'range': 'A:G',
+             'db_table': f'bench_responses_{idx}',
+             'wp_link': f'https://example.com/seminario-{idx}',
+             'seminar': f'Seminario {idx}'}
+            for idx in range(scenario['files'])
+        ]
+    }
+
+
+def build_service(scenario: dict, config: dict):
+    from benchmark.fake_sheets import FakeSheetsService
+
+    # responses are generated deterministically, so every process serves the same rows
+    service = FakeSheetsService(scenario['latency'])
+    rows_per_page = max(1, scenario['rows'] // (scenario['files'] * scenario['pages']))
+    for metadata in config['google_sheets_files_metadata']:
+        service.add_spreadsheet(metadata['id'], scenario['pages'], rows_per_page)
+    return service, rows_per_page
+
+
+def build_datasource():
+    from datasource.mysql import MySQLDataSource
+
+    return MySQLDataSource(os.getenv('BENCHMARK_DB_HOST', '127.0.0.1'),
+                           os.getenv('BENCHMARK_DB_USER', 'root'),
+                           os.getenv('BENCHMARK_DB_PASSWORD', ''),
+                           os.getenv('BENCHMARK_DB_DATABASE', 'forms_etl_benchmark'),
+                           write_method=os.getenv('DB_WRITE_METHOD', 'executemany'))
+
+
+def setup_environment(config: dict) -> None:
+    os.environ['GOOGLE_SHEETS_CONFIG'] = json.dumps(config)
+    os.environ.setdefault('EXTRACTION_INTERVAL', '{"hours": 1}')
+
+
+def seed_scenario(scenario: dict, queue: multiprocessing.Queue) -> None:
+    """Recreates the tables of the scenario and, for incremental scenarios, loads
+    the existing responses. Runs in its own process so the initial load does not
+    count in the peak memory of the measured run"""
+    config = build_config(scenario)
+    setup_environment(config)
+
+    from etl.google_sheets.google_sheets import GoogleSheetsFileBatch
+    from etl.google_sheets.google_sheets_extractor import GoogleSheetsExtractor
+    from util.filter_strategy import FilterByWatermarkStrategy
+
+    datasource = build_datasource()
+
+    with datasource as conn:
+        FilterByWatermarkStrategy.create_table(conn)
+        for metadata in config['google_sheets_files_metadata']:
+            conn.execute(f"DROP TABLE IF EXISTS {metadata['db_table']}")
+            conn.execute(TABLE_DDL.format(db_table=metadata['db_table']))
+            conn.execute(f"DELETE FROM {FilterByWatermarkStrategy.TABLE} WHERE db_table = :db_table",
+                         {'db_table': metadata['db_table']})
+        conn.commit()
+
+    if scenario['mode'] == 'incremental':
+        service, _ = build_service(scenario, config)
+        GoogleSheetsExtractor(datasource, service).execute(
+            google_sheets_files_list=GoogleSheetsFileBatch(datasource, service).google_sheets_files
+        )
+
+    datasource.dispose()
+    queue.put({})
+
+
+def run_scenario(scenario: dict, queue: multiprocessing.Queue) -> None:
+    config = build_config(scenario)
+    setup_environment(config)
+
+    from etl.google_sheets.google_sheets import GoogleSheetsFileBatch
+    from etl.google_sheets.google_sheets_extractor import GoogleSheetsExtractor
+    from util.metrics import metrics
+
+    service, rows_per_page = build_service(scenario, config)
+    if scenario['mode'] == 'incremental':
+        new_rows_per_page = max(1, int(rows_per_page * scenario['new_rows_ratio']))
+        for metadata in config['google_sheets_files_metadata']:
+            for sheet in service.get_sheets(metadata['id']):
+                service.append_rows(metadata['id'], sheet['properties']['title'], new_rows_per_page)
+
+    datasource = build_datasource()
+
+    service.calls = 0
+    metrics.reset()
+    # ru_maxrss is reported in kilobytes on Linux, the baseline holds the imports and the synthetic responses
+    baseline_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    start = time.perf_counter()
+    google_sheets_file_batch = GoogleSheetsFileBatch(datasource, service)
+    metadata_end = time.perf_counter()
+
+    extractor = GoogleSheetsExtractor(datasource, service)
+    extractor.execute(google_sheets_files_list=google_sheets_file_batch.google_sheets_files)
+    end = time.perf_counter()
+
+    datasource.dispose()
+
+    extract_duration = end - metadata_end
+
+    queue.put({
+        **scenario,
+        'new_rows': extractor.total_new_rows,
+        'api_calls': service.calls,
+        'total_seconds': end - start,
+        'rows_per_second': extractor.total_new_rows / extract_duration if extract_duration > 0 else None,
+        'metadata_seconds': metadata_end - start,
+        'stages': metrics.summary()['stages'],
+        'baseline_rss_mb': baseline_rss_mb,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def scenario_name(scenario: dict) -> str:
+    return (f"{scenario['mode']}-rows{scenario['rows']}-files{scenario['files']}"
+            f"-pages{scenario['pages']}-latency{scenario['latency']}")
+
+
+def get_git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results: list[dict], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+
+    for result in results:
+        previous = baseline.get(result['name'])
+        if previous is None or not previous['rows_per_second'] or not result['rows_per_second']:
+            continue
+        ratio = result['rows_per_second'] / previous['rows_per_second']
+        print(f"{result['name']}: {result['rows_per_second']:.0f} rows/s"
+              f" vs {previous['rows_per_second']:.0f} rows/s ({ratio:.2f}x)")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Offline benchmark of the forms ETL')
+    parser.add_argument('--rows', default='1000,10000,100000,1000000',
+                        help='comma separated total rows per scenario')
+    parser.add_argument('--modes', default='historical,incremental')
+    parser.add_argument('--files', type=int, default=2)
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='seconds of latency injected in every Sheets call')
+    parser.add_argument('--new-rows-ratio', type=float, default=0.01,
+                        help='new rows appended per page in incremental scenarios, as a ratio')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None,
+                        help='previous results file to compare rows/s against')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    results = []
+
+    for mode in args.modes.split(','):
+        for rows in [int(rows) for rows in args.rows.split(',')]:
+            scenario = {'mode': mode, 'rows': rows, 'files': args.files, 'pages': args.pages,
+                        'latency': args.latency, 'new_rows_ratio': args.new_rows_ratio}
+            scenario['name'] = scenario_name(scenario)
+
+            _, exitcode = run_in_process(seed_scenario, scenario)
+            if exitcode != 0:
+                print(f"{scenario['name']}: seed failed with exit code {exitcode}", file=sys.stderr)
+                continue
+
+            result, exitcode = run_in_process(run_scenario, scenario)
+            if exitcode != 0 or result is None:
+                print(f"{scenario['name']}: failed with exit code {exitcode}", file=sys.stderr)
+                continue
+
+            results.append(result)
+            print(f"{result['name']}: {result['new_rows']} rows in {result['total_seconds']:.2f}s,"
+                  f" {result['rows_per_second'] or 0:.0f} rows/s, peak {result['peak_rss_mb']:.0f} MB")
+
+    output = args.output or os.path.join(os.path.dirname(__file__), 'results',
+                                         f"{dt.now().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'meta': {'git_revision': get_git_revision(),
+                            'created_at': dt.now().isoformat(),
+                            'python': platform.python_version(),
+                            'platform': platform.platform()},
+                   'results': results}, f, indent=2)
+    print(f'Results stored in {output}')
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
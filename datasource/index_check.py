@@ -0,0 +1,89 @@
+import logging
+
+from datasource.connection_wrapper import SQLAlchemyConnectionWrapper
+
+
+class TableIndexCheck():
+    """Checks that the response tables have the composite index the ETL queries
+    rely on. With it, the last recorded value per page and the distinct pages are
+    read with loose index scans and the fingerprint and watermark lookups with
+    range scans, instead of scanning the whole table. Missing indexes are
+    reported and, with create_missing, added online without locking the table"""
+
+    INDEX_NAME = 'etl_pestania_marca_correo'
+    INDEX_COLUMNS = ('pestania', 'marca_temporal', 'correo')
+    FULL_SCAN_ACCESS_TYPES = ('ALL', 'index')
+
+    def __init__(self, create_missing: bool=False) -> None:
+        self.create_missing = create_missing
+
+    def check(self, conn: SQLAlchemyConnectionWrapper, database: str, tables: list[str],
+              queries: dict[str, list[tuple[str, dict]]]=None) -> list[str]:
+        """Returns the tables still missing the index. queries are explained per
+        table once the index is in place, logging the ones that scan the table.
+        Queries that fail to be explained are logged and skipped"""
+        missing = self.get_missing(conn, database, tables)
+
+        for table in missing:
+            if not self.create_missing:
+                logging.warning(f"{type(self).__name__} - Table '{table}' has no index on"
+                                f" ({', '.join(self.INDEX_COLUMNS)}). Its metadata queries scan the whole table")
+                continue
+            try:
+                self.create(conn, table)
+            except Exception as e:
+                logging.error(f"{type(self).__name__} - Index on table '{table}' could not be created: {e}")
+
+        missing = self.get_missing(conn, database, missing) if self.create_missing else missing
+
+        for table, table_queries in (queries or {}).items():
+            for query, params in table_queries:
+                try:
+                    scanned_tables = self.explain(conn, query, params)
+                except Exception as e:
+                    logging.error(f"{type(self).__name__} - Query of table '{table}' could not be explained: {e}")
+                    continue
+                for scanned_table in scanned_tables:
+                    logging.warning(f"{type(self).__name__} - Full scan of '{scanned_table}' in query: "
+                                    f"{' '.join(query.split())}")
+        return missing
+
+    def get_missing(self, conn: SQLAlchemyConnectionWrapper, database: str, tables: list[str]) -> list[str]:
+        if len(tables) == 0:
+            return []
+
+        indexes: dict[tuple[str, str], list[str]] = {}
+        for table, index, column in conn.execute(self._index_columns_query(database, tables)).fetchall():
+            indexes.setdefault((table, index), []).append(column)
+
+        indexed_tables = {table for (table, _), columns in indexes.items()
+                          if tuple(columns[:len(self.INDEX_COLUMNS)]) == self.INDEX_COLUMNS}
+        return [table for table in tables if table not in indexed_tables]
+
+    def create(self, conn: SQLAlchemyConnectionWrapper, table: str) -> None:
+        logging.info(f"{type(self).__name__} - Creating index {self.INDEX_NAME} on table '{table}'")
+        conn.execute(self._create_index_query(table))
+        logging.info(f"{type(self).__name__} - Index {self.INDEX_NAME} created on table '{table}'")
+
+    def explain(self, conn: SQLAlchemyConnectionWrapper, query: str, params: dict=None) -> list[str]:
+        """Returns the base tables the query reads with a full table or index scan"""
+        rows = conn.execute(f'EXPLAIN {query}', params).fetchall()
+        return [row._mapping['table'] for row in rows
+                if row._mapping['type'] in self.FULL_SCAN_ACCESS_TYPES
+                and row._mapping['table'] is not None
+                and not row._mapping['table'].startswith('<')]
+
+    def _index_columns_query(self, database: str, tables: list[str]):
+        return f"""SELECT `TABLE_NAME`, `INDEX_NAME`, `COLUMN_NAME`
+                FROM `INFORMATION_SCHEMA`.`STATISTICS`
+                WHERE `TABLE_SCHEMA`='{database}'
+                AND `TABLE_NAME` IN ({', '.join(f"'{table}'" for table in tables)})
+                ORDER BY `TABLE_NAME`, `INDEX_NAME`, `SEQ_IN_INDEX`;
+                """
+
+    def _create_index_query(self, table: str):
+        # in place index builds let reads and writes go on while the index is created
+        return f"""ALTER TABLE {table}
+                ADD INDEX {self.INDEX_NAME} ({', '.join(f'`{column}`' for column in self.INDEX_COLUMNS)}),
+                ALGORITHM=INPLACE, LOCK=NONE;
+                """
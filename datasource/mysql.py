@@ -1,12 +1,25 @@
+import os
 import logging
+import tempfile
+import threading
+from contextlib import contextmanager
 
-from sqlalchemy import create_engine, URL
+import polars as pl
+from sqlalchemy import create_engine, URL, Engine
 
 from datasource.connection_wrapper import SQLAlchemyConnectionWrapper
 
 class MySQLDataSource():
 
-    def __init__(self, host: str, user: str, password: str, db: str) -> None:
+    WRITE_METHODS = ('load_data', 'executemany', 'pandas')
+
+    def __init__(self, host: str, user: str, password: str, db: str,
+                 pool_size: int=5, max_overflow: int=10,
+                 pool_recycle: int=3600, pool_pre_ping: bool=True,
+                 write_method: str='executemany', executemany_batch_size: int=1000) -> None:
+        if write_method not in self.WRITE_METHODS:
+            raise Exception(f'write_method must be one of {self.WRITE_METHODS}')
+
         self._HOST = host
         self._USER = user
         self._PASSWORD = password
@@ -18,23 +31,171 @@ class MySQLDataSource():
             host=self._HOST,
             database=self._DB
         )
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_recycle = pool_recycle
+        self.pool_pre_ping = pool_pre_ping
+        self.write_method = write_method
+        self.executemany_batch_size = executemany_batch_size
+        self._engine: Engine = None
+        self._engine_lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def engine(self) -> Engine:
+        """Pooled engine shared by every connection borrowed from this datasource.
+        Created on first use"""
+        if self._engine is None:
+            with self._engine_lock:
+                if self._engine is None:
+                    self._engine = create_engine(self.url,
+                                                 echo=False,
+                                                 pool_size=self.pool_size,
+                                                 max_overflow=self.max_overflow,
+                                                 pool_recycle=self.pool_recycle,
+                                                 pool_pre_ping=self.pool_pre_ping,
+                                                 connect_args=({'local_infile': 1}
+                                                               if self.write_method == 'load_data'
+                                                               else {}))
+                    logging.info(f'MySQL engine for database {self._DB} created')
+        return self._engine
 
     def __enter__(self) -> SQLAlchemyConnectionWrapper:
-        engine = create_engine(self.url, echo=False)
-        self._CONNECTION = SQLAlchemyConnectionWrapper(engine.connect())
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = []
+        connection = SQLAlchemyConnectionWrapper(self.engine.connect())
+        self._local.connections.append(connection)
         logging.info(f'MySQL connection to database {self._DB} stablished')
-        return self._CONNECTION
+        return connection
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        self._CONNECTION.close()
+        self._local.connections.pop().close()
         logging.info(f'MySQL connection to database {self._DB} terminated')
 
-    # def connect(self):
-    #     engine = create_engine(self._url, echo=False)
-    #     self._CONNECTION = SQLAlchemyConnectionWrapper(engine.connect())
-    #     logging.info(f'MySQL connection to database {self._DB} stablished')
-    #     return self._CONNECTION
-    
-    # def close(self):
-    #     self._CONNECTION.close()
-    #     logging.info(f'MySQL connection to database {self._DB} terminated')
\ No newline at end of file
+    @contextmanager
+    def transaction(self):
+        """Borrows a pooled connection wrapped in a transaction that is committed
+        on success and rolled back on error"""
+        with self.engine.begin() as conn:
+            yield SQLAlchemyConnectionWrapper(conn)
+
+    def write_dataframe(self, df: pl.DataFrame, db_table: str,
+                        conn: SQLAlchemyConnectionWrapper=None, columns: list[str]=None) -> None:
+        """Appends df to db_table using the configured write method. Only the
+        given table columns present in df are written, in table order. Runs in
+        its own transaction unless an already open transaction connection is given"""
+        if conn is None:
+            with self.transaction() as conn:
+                self.write_dataframe(df, db_table, conn, columns)
+            return
+
+        if columns is not None:
+            df = df.select([column for column in columns if column in df.columns])
+
+        if self.write_method == 'load_data':
+            self._load_data(df, db_table, conn)
+        elif self.write_method == 'executemany':
+            self._executemany(df, db_table, conn)
+        else:
+            df.to_pandas(use_pyarrow_extension_array=True).to_sql(
+                db_table, conn.conn, if_exists='append', index=False
+            )
+
+    def merge_dataframe(self, df: pl.DataFrame, db_table: str, key_columns: list[str],
+                        conn: SQLAlchemyConnectionWrapper=None,
+                        columns: list[str]=None) -> tuple[int, int]:
+        """Merges df into db_table on the natural key key_columns through a temporary
+        staging table loaded with the configured write method. Rows whose key is
+        found are updated when any of their columns differs, the rest are inserted.
+        Returns the number of inserted and updated rows"""
+        if conn is None:
+            with self.transaction() as conn:
+                return self.merge_dataframe(df, db_table, key_columns, conn, columns)
+
+        if columns is not None:
+            df = df.select([column for column in columns if column in df.columns])
+        df = df.unique(subset=key_columns, keep='last', maintain_order=True)
+        value_columns = [column for column in df.columns if column not in key_columns]
+
+        staging_table = f'{db_table}_staging'
+        conn.execute(f'DROP TEMPORARY TABLE IF EXISTS {staging_table};')
+        conn.execute(f'CREATE TEMPORARY TABLE {staging_table} LIKE {db_table};')
+        try:
+            if self.write_method == 'load_data':
+                self._load_data(df, staging_table, conn)
+            else:
+                # pandas to_sql can't see temporary tables
+                self._executemany(df, staging_table, conn)
+
+            # existing keys are updated first so the inserted rows are not compared again
+            updated = (conn.execute(self._merge_update_query(db_table, staging_table,
+                                                             key_columns, value_columns)).rowcount
+                       if len(value_columns) > 0 else 0)
+            inserted = conn.execute(self._merge_insert_query(db_table, staging_table,
+                                                             key_columns, df.columns)).rowcount
+        finally:
+            conn.execute(f'DROP TEMPORARY TABLE IF EXISTS {staging_table};')
+
+        logging.info(f'MySQL merge into {db_table}. {inserted} rows inserted, {updated} rows updated')
+        return inserted, updated
+
+    def _load_data(self, df: pl.DataFrame, db_table: str, conn: SQLAlchemyConnectionWrapper) -> None:
+        """Bulk loads df through a temporary CSV file written by polars and
+        LOAD DATA LOCAL INFILE. Requires local_infile enabled in the server"""
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        try:
+            df.write_csv(path, null_value='NULL', datetime_format='%Y-%m-%d %H:%M:%S')
+            conn.execute(self._load_data_query(path, db_table, df.columns))
+        finally:
+            os.remove(path)
+
+    def _executemany(self, df: pl.DataFrame, db_table: str, conn: SQLAlchemyConnectionWrapper) -> None:
+        """Inserts df in multi row batches. mysqlclient rewrites executemany
+        of a single INSERT ... VALUES into multi row statements"""
+        query = self._insert_query(db_table, df.columns)
+        for chunk in df.iter_slices(self.executemany_batch_size):
+            conn.execute(query, chunk.to_dicts())
+
+    def _load_data_query(self, path: str, db_table: str, columns: list[str]):
+        # with an empty ESCAPED BY, an unquoted NULL field is read as NULL
+        return f"""LOAD DATA LOCAL INFILE '{path}'
+                INTO TABLE {db_table}
+                CHARACTER SET utf8mb4
+                FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+                LINES TERMINATED BY '\\n'
+                IGNORE 1 LINES
+                ({', '.join(f'`{column}`' for column in columns)});
+                """
+
+    def _insert_query(self, db_table: str, columns: list[str]):
+        return f"""INSERT INTO {db_table} ({', '.join(f'`{column}`' for column in columns)})
+                VALUES ({', '.join(f':{column}' for column in columns)});
+                """
+
+    def _merge_update_query(self, db_table: str, staging_table: str,
+                            key_columns: list[str], value_columns: list[str]):
+        # rows are only touched when a column changed, so the count is the number of edited rows
+        return f"""UPDATE {db_table} AS t
+                JOIN {staging_table} AS s
+                ON {' AND '.join(f't.`{column}` <=> s.`{column}`' for column in key_columns)}
+                SET {', '.join(f't.`{column}` = s.`{column}`' for column in value_columns)}
+                WHERE NOT ({' AND '.join(f't.`{column}` <=> s.`{column}`' for column in value_columns)});
+                """
+
+    def _merge_insert_query(self, db_table: str, staging_table: str,
+                            key_columns: list[str], columns: list[str]):
+        return f"""INSERT INTO {db_table} ({', '.join(f'`{column}`' for column in columns)})
+                SELECT {', '.join(f's.`{column}`' for column in columns)}
+                FROM {staging_table} AS s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {db_table} AS t
+                    WHERE {' AND '.join(f't.`{column}` <=> s.`{column}`' for column in key_columns)}
+                );
+                """
+
+    def dispose(self) -> None:
+        if self._engine is not None:
+            self._engine.dispose()
+            self._engine = None
+            logging.info(f'MySQL engine for database {self._DB} disposed')
@@ -0,0 +1,14 @@
+import io
+
+import ijson
+import pyarrow as pa
+
+
+def decode_columns(content: bytes, prefix: str='values') -> list[pa.Array]:
+    """Decodes the raw JSON body of a values.get response fetched with
+    majorDimension=COLUMNS into one Arrow large_string array per column, the
+    string type polars uses, so they are wrapped without copies. ijson parses
+    the payload incrementally, with its C backend when available, so only one
+    column is held as a python list at a time instead of the whole nested list"""
+    return [pa.array(column, type=pa.large_string())
+            for column in ijson.items(io.BytesIO(content), f'{prefix}.item')]
@@ -0,0 +1,103 @@
+import os
+import abc
+import json
+import hashlib
+import logging
+
+from googleapiclient.discovery import Resource
+
+from util.metrics import metrics
+from etl.google_sheets.request_executor import sheets_requests
+
+
+class RevisionSource(metaclass=abc.ABCMeta):
+    """Returns a marker that changes whenever a spreadsheet receives new data"""
+
+    @abc.abstractmethod
+    def get_revision(self, google_sheets_file_id: str) -> str:
+        raise NotImplementedError
+
+    @classmethod
+    def __subclasshook__(cls, subclass):
+        return (hasattr(subclass, 'get_revision') and
+                callable(subclass.get_revision) or
+                NotImplemented)
+
+
+class DriveModifiedTimeRevisionSource(RevisionSource):
+
+    def __init__(self, drive_service: Resource):
+        self.drive_service = drive_service
+
+    def get_revision(self, google_sheets_file_id: str) -> str:
+        request = self.drive_service.files().get(fileId=google_sheets_file_id, fields='modifiedTime')
+        return sheets_requests.execute(request)['modifiedTime']
+
+
+class SheetsGridRevisionSource(RevisionSource):
+    """Uses the row count of every page, which grows as forms append responses.
+    Does not need Drive API access"""
+
+    def __init__(self, sheets_service: Resource):
+        self.sheets_service = sheets_service
+
+    def get_revision(self, google_sheets_file_id: str) -> str:
+        request = (self.sheets_service.spreadsheets()
+                   .get(spreadsheetId=google_sheets_file_id,
+                        fields='sheets.properties(title,gridProperties.rowCount)'))
+        sheets = sheets_requests.execute(request)['sheets']
+        grid = [(sheet['properties']['title'], sheet['properties']['gridProperties']['rowCount'])
+                for sheet in sheets]
+        return hashlib.sha1(json.dumps(grid).encode()).hexdigest()
+
+
+class ChangeDetector():
+    """Skips spreadsheets whose revision matches the one stored after their last
+    successful extraction. State is persisted as a local JSON file"""
+
+    def __init__(self, revision_source: RevisionSource, state_path: str):
+        self.revision_source = revision_source
+        self.state_path = state_path
+        self._stored_revisions = self._load()
+        self._pending_revisions = {}
+
+    def filter_changed(self, google_sheets_files_metadata: list[dict]) -> list[dict]:
+        changed = []
+        for google_sheets_file_metadata in google_sheets_files_metadata:
+            file_id = google_sheets_file_metadata['id']
+            with metrics.stage('change_detection', file=file_id):
+                revision = self.revision_source.get_revision(file_id)
+
+            if self._stored_revisions.get(file_id) == revision:
+                logging.info(f"{type(self).__name__} - File '{file_id}' unchanged since last run. Skipped")
+                continue
+
+            self._pending_revisions[file_id] = revision
+            changed.append(google_sheets_file_metadata)
+        return changed
+
+    def get_pending_revision(self, google_sheets_file_id: str) -> str:
+        """Returns the revision seen by filter_changed for the file, if any"""
+        return self._pending_revisions.get(google_sheets_file_id)
+
+    def discard(self, google_sheets_file_ids: list[str]) -> None:
+        """Forgets the pending revisions of files left out of the run, so they
+        are still seen as changed in the next one"""
+        for google_sheets_file_id in google_sheets_file_ids:
+            self._pending_revisions.pop(google_sheets_file_id, None)
+
+    def commit(self) -> None:
+        """Stores the revisions of the files returned by filter_changed.
+        Must only be called once they have been extracted successfully"""
+        self._stored_revisions.update(self._pending_revisions)
+        self._pending_revisions = {}
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._stored_revisions, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _load(self) -> dict[str, str]:
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
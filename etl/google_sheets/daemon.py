@@ -0,0 +1,145 @@
+import os
+import time
+import heapq
+import signal
+import logging
+import threading
+
+from googleapiclient.discovery import Resource
+
+from datasource.mysql import MySQLDataSource
+from etl.google_sheets.google_sheets import GoogleSheetsFile, GoogleSheetsFileBatch
+from etl.google_sheets.google_sheets_extractor import GoogleSheetsExtractor
+from etl.google_sheets.change_detection import ChangeDetector
+
+
+class FileSchedule():
+    """Polling state of one configured spreadsheet. The interval follows the
+    observed new rows rate so that each poll finds about target_rows rows, and
+    grows by idle_backoff while the form receives nothing.
+
+    The discovered file is kept between polls, its pages advanced in memory by
+    the extractor, and is discovered again only when the change detector reports
+    a change, a header changed or the last poll failed. Tail fetches read past
+    the discovered grid row count, which is raised in memory to the row cursors"""
+
+    def __init__(self, google_sheets_file_metadata: dict, interval: float) -> None:
+        self.metadata = google_sheets_file_metadata
+        self.interval = interval
+        self.rows_per_second = 0.0
+        self.last_run: float = None
+        self.google_sheets_file: GoogleSheetsFile = None
+        self._header_hashes: dict[str, str] = {}
+
+    def needs_discovery(self) -> bool:
+        if self.google_sheets_file is None:
+            return True
+        for google_sheets_page in self.google_sheets_file.google_sheets_pages:
+            filter_value = google_sheets_page.filter_value
+            row_cursor = getattr(filter_value, 'row_cursor', None)
+            if row_cursor is None:
+                continue
+            header_hash = self._header_hashes.get(google_sheets_page.title, filter_value.header_hash)
+            if header_hash != filter_value.header_hash:
+                return True
+        return False
+
+    def keep(self, google_sheets_file: GoogleSheetsFile) -> None:
+        self.google_sheets_file = google_sheets_file
+        self._header_hashes = {
+            google_sheets_page.title: getattr(google_sheets_page.filter_value, 'header_hash', None)
+            for google_sheets_page in google_sheets_file.google_sheets_pages
+        }
+
+    def update(self, new_rows: int, now: float, min_interval: float, max_interval: float,
+               target_rows: int, idle_backoff: float, smoothing: float=0.5) -> None:
+        elapsed = now - self.last_run if self.last_run is not None else self.interval
+        self.last_run = now
+
+        observed = new_rows / elapsed if elapsed > 0 else 0.0
+        self.rows_per_second = smoothing * observed + (1 - smoothing) * self.rows_per_second
+
+        if new_rows > 0 and self.rows_per_second > 0:
+            interval = target_rows / self.rows_per_second
+        else:
+            interval = self.interval * idle_backoff
+
+        self.interval = min(max_interval, max(min_interval, interval))
+
+
+class GoogleSheetsDaemon():
+    """Long running mode. Keeps the Sheets client, the pooled engine and the
+    discovered files warm and polls every spreadsheet on its own interval"""
+
+    MIN_INTERVAL = float(os.getenv('DAEMON_MIN_INTERVAL', '60'))
+    MAX_INTERVAL = float(os.getenv('DAEMON_MAX_INTERVAL', '3600'))
+    TARGET_ROWS_PER_POLL = int(os.getenv('DAEMON_TARGET_ROWS_PER_POLL', '10'))
+    IDLE_BACKOFF = float(os.getenv('DAEMON_IDLE_BACKOFF', '2'))
+
+    def __init__(self, datasource: MySQLDataSource, service: Resource,
+                 change_detector: ChangeDetector=None) -> None:
+        self.datasource = datasource
+        self.service = service
+        self.change_detector = change_detector
+        self.extractor = GoogleSheetsExtractor(datasource, service)
+        self._stop = threading.Event()
+        self._queue: list[tuple[float, int, FileSchedule]] = []
+
+        now = time.monotonic()
+        for idx, google_sheets_file_metadata in enumerate(
+                GoogleSheetsFileBatch.GOOGLE_SHEETS_CONFIG['google_sheets_files_metadata']):
+            heapq.heappush(self._queue,
+                           (now, idx, FileSchedule(google_sheets_file_metadata, self.MIN_INTERVAL)))
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+        logging.info(f"{type(self).__name__} - Started with {len(self._queue)} spreadsheets")
+
+        while not self._stop.is_set():
+            next_run, idx, schedule = self._queue[0]
+            wait = next_run - time.monotonic()
+            if wait > 0:
+                self._stop.wait(wait)
+                continue
+
+            heapq.heappop(self._queue)
+            self._poll(schedule)
+            heapq.heappush(self._queue, (time.monotonic() + schedule.interval, idx, schedule))
+
+        logging.info(f"{type(self).__name__} - Stopped")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _poll(self, schedule: FileSchedule) -> None:
+        file_id = schedule.metadata['id']
+        new_rows = 0
+        try:
+            google_sheets_files_metadata = [schedule.metadata]
+            if self.change_detector is not None:
+                google_sheets_files_metadata = self.change_detector.filter_changed(google_sheets_files_metadata)
+
+            if len(google_sheets_files_metadata) > 0:
+                if self.change_detector is not None or schedule.needs_discovery():
+                    google_sheets_file_batch = GoogleSheetsFileBatch(self.datasource, self.service,
+                                                                     self.change_detector,
+                                                                     google_sheets_files_metadata)
+                    schedule.keep(google_sheets_file_batch.google_sheets_files[0])
+                total_new_rows = self.extractor.total_new_rows
+                self.extractor.execute(google_sheets_files_list=[schedule.google_sheets_file])
+                new_rows = self.extractor.total_new_rows - total_new_rows
+
+                if self.change_detector is not None:
+                    self.change_detector.commit()
+
+            schedule.update(new_rows, time.monotonic(), self.MIN_INTERVAL, self.MAX_INTERVAL,
+                            self.TARGET_ROWS_PER_POLL, self.IDLE_BACKOFF)
+        except Exception as e:
+            logging.exception(e)
+            # pages may be behind what was committed, they are read back on the next poll
+            schedule.google_sheets_file = None
+            schedule.interval = min(self.MAX_INTERVAL, schedule.interval * self.IDLE_BACKOFF)
+
+        logging.info(f"{type(self).__name__} - File '{file_id}' polled. {new_rows} new rows."
+                     f" Next poll in {schedule.interval:.0f}s")
@@ -1,29 +1,82 @@
 import os
-import json
+import re
 from dotenv import load_dotenv
 
+from datetime import datetime as dt
+
 from googleapiclient.discovery import Resource
 
 from datasource.mysql import MySQLDataSource
+from datasource.connection_wrapper import SQLAlchemyConnectionWrapper
+from etl.google_sheets.change_detection import ChangeDetector
+from etl.google_sheets.transformation import ColumnTransformations
 from constant.enum import Mode
-from util.filter_strategy import FilterByLastRecordedValueStrategy
-from util.filter import FilterValue
+from util.filter_strategy import FilterByLastRecordedValueStrategy, FilterByWatermarkStrategy
+from util.filter import FilterValue, LastRecordedValue, Watermark
+from util.fingerprint import RowFingerprint
+from util.metrics import metrics
+from util.config import EnvJson
 
 
 load_dotenv()
 
 class GoogleSheetsPage():
 
+    COLUMN_RANGE_PATTERN = re.compile(r'^([A-Za-z]+)1?:([A-Za-z]+)$')
+
     def __init__(self, title: str, range: str, mode: Mode, file_id: str, sheet_id: str,
-                 filter_value: FilterValue) -> None:
+                 filter_value: FilterValue, row_count: int=None) -> None:
         self.title = title
         self.range = range
         self.mode = mode
         self.link = f'https://docs.google.com/spreadsheets/d/{file_id}/edit?resourcekey#gid={sheet_id}'
         self.filter_value = filter_value
+        self.row_count = row_count
 
     def get_full_range(self) -> str:
         return f'{self.title}!{self.range}'
+
+    def advance(self, datetime_to_filter_by: dt, emails: list[str]) -> None:
+        """Moves the filter value past rows just written, the way the stored
+        watermark is advanced, so the page can be extracted again without
+        reading it back"""
+        if self.filter_value is None:
+            filter_value_class = Watermark if FilterByWatermarkStrategy.ENABLED else LastRecordedValue
+            self.filter_value = filter_value_class(datetime_to_filter_by, self.title, emails)
+            self.mode = Mode.INCREMENTAL
+        elif datetime_to_filter_by > self.filter_value.datetime_to_filter_by:
+            self.filter_value.datetime_to_filter_by = datetime_to_filter_by
+            self.filter_value.emails = emails
+        elif datetime_to_filter_by == self.filter_value.datetime_to_filter_by:
+            self.filter_value.emails = list(dict.fromkeys(self.filter_value.emails + emails))
+
+    def advance_row_cursor(self, row_cursor: int, header_hash: str) -> None:
+        # Forms grows the grid up to the last response, the rows read prove it is at least that long
+        if self.row_count is not None:
+            self.row_count = max(self.row_count, row_cursor)
+        # as in the watermark table, pages without a watermark keep no row cursor
+        if isinstance(self.filter_value, Watermark):
+            self.filter_value.row_cursor = row_cursor
+            self.filter_value.header_hash = header_hash
+
+    def get_header_range(self) -> str:
+        first_column, last_column = self._get_column_bounds()
+        return f'{self.title}!{first_column}1:{last_column}1'
+
+    def get_tail_range(self, start_row: int) -> str:
+        first_column, last_column = self._get_column_bounds()
+        return f'{self.title}!{first_column}{start_row}:{last_column}'
+
+    def get_rows_range(self, start_row: int, end_row: int) -> str:
+        first_column, last_column = self._get_column_bounds()
+        return f'{self.title}!{first_column}{start_row}:{last_column}{end_row}'
+
+    def supports_tail_range(self) -> bool:
+        """Tail ranges can only be derived from column ranges such as A:Z or A1:Z"""
+        return self.COLUMN_RANGE_PATTERN.match(self.range) is not None
+
+    def _get_column_bounds(self) -> tuple[str, str]:
+        return self.COLUMN_RANGE_PATTERN.match(self.range).groups()
     
     def get_title_and_link(self) -> list[str]:
         return [self.title, self.link]
@@ -32,7 +85,7 @@ class GoogleSheetsPage():
 class _GoogleSheetsPageListBuilder():
 
     def __init__(self, service: Resource, google_sheets_file_id: str, pages_in_db: list[str],
-                 filter_values: list[FilterValue], excluded_pages: list[str]):
+                 filter_values: dict[str, FilterValue], excluded_pages: list[str]):
         self.google_sheets_pages = []
         self.service = service
         self.google_sheets_file_id = google_sheets_file_id
@@ -45,14 +98,18 @@ class _GoogleSheetsPageListBuilder():
         return self
 
     def build(self):
-        page_titles = [(page['properties']['sheetId'], page['properties']['title'])
-                        for page
-                        in self.service.spreadsheets()
-                        .get(spreadsheetId=self.google_sheets_file_id)
-                        .execute()['sheets']
-                        if page['properties']['title'] not in self.excluded_pages]
+        with metrics.stage('metadata_sheets', file=self.google_sheets_file_id):
+            request = (self.service.spreadsheets()
+                       .get(spreadsheetId=self.google_sheets_file_id,
+                            fields='sheets.properties(sheetId,title,gridProperties.rowCount)'))
+            page_titles = [(page['properties']['sheetId'],
+                            page['properties']['title'],
+                            page['properties'].get('gridProperties', {}).get('rowCount'))
+                            for page
+                            in sheets_requests.execute(request)['sheets']
+                            if page['properties']['title'] not in self.excluded_pages]
         
-        for page_id, page_title in page_titles:
+        for page_id, page_title, row_count in page_titles:
             mode = Mode.INCREMENTAL if page_title in self.pages_in_db else Mode.HISTORICAL
             filter_value = None
 
@@ -63,7 +120,7 @@ class _GoogleSheetsPageListBuilder():
 
             self.google_sheets_pages.append(
                 GoogleSheetsPage(page_title, self._range,
-                                 mode, self.google_sheets_file_id, page_id, filter_value)
+                                 mode, self.google_sheets_file_id, page_id, filter_value, row_count)
             )
         return self.google_sheets_pages
 
@@ -96,9 +153,21 @@ class GoogleSheetsFileBuilder():
     def excluded_columns(self, excluded_columns: str):
         self.google_sheets_file.excluded_columns = excluded_columns
         return self
+
+    def revision(self, revision: str):
+        self.google_sheets_file.revision = revision
+        return self
+
+    def transformations(self, transformations: ColumnTransformations):
+        self.google_sheets_file.transformations = transformations
+        return self
+
+    def typed_fetch(self, typed_fetch: bool):
+        self.google_sheets_file.typed_fetch = typed_fetch
+        return self
     
     def google_sheets_pages(self, service: Resource, range: str, pages_in_db: list[str],
-                            filter_values: list[FilterValue], excluded_pages: list[str]):
+                            filter_values: dict[str, FilterValue], excluded_pages: list[str]):
         self.google_sheets_file.google_sheets_pages = \
             (_GoogleSheetsPageListBuilder(
                     service,
@@ -123,7 +192,10 @@ class GoogleSheetsFile():
                  columns: list[str]=None,
                  wordpress_link: str=None,
                  seminar_title: str=None,
-                 excluded_columns: list[str]=None) -> None:
+                 excluded_columns: list[str]=None,
+                 revision: str=None,
+                 transformations: ColumnTransformations=None,
+                 typed_fetch: bool=False) -> None:
         self.id = id
         self.google_sheets_pages = google_sheets_pages
         self.db_table = db_table
@@ -131,18 +203,31 @@ class GoogleSheetsFile():
         self.wordpress_link = wordpress_link
         self.seminar_title = seminar_title
         self.excluded_columns = excluded_columns
+        self.revision = revision
+        self.transformations = transformations
+        self.typed_fetch = typed_fetch
 
     def get_google_sheets_columns(self) -> list[str]:
         """Returns columns found in original google sheets.
-        Excludes database Primary Key, tab name, google sheets link, wordpress link,
-        seminar name and status"""
-        return self.columns[1:-5]
+        Excludes database Primary Key, the custom columns and row fingerprint"""
+        return self.get_transformations().sheet_columns
     
     def get_custom_columns(self) -> list[str]:
         """Returns only custom columns not found in original google sheets
-        nor database Primary Key. These columns are tab name, google sheets link,
-        wordpress link, seminar name and status"""
-        return self.columns[-5:]
+        nor database Primary Key. By default these columns are tab name, google
+        sheets link, wordpress link, seminar name and status"""
+        return self.get_transformations().get_custom_columns()
+
+    def get_transformations(self) -> ColumnTransformations:
+        if self.transformations is None:
+            self.transformations = ColumnTransformations.compile(self._get_data_columns())
+        return self.transformations
+
+    def has_fingerprint(self) -> bool:
+        return RowFingerprint.COLUMN in self.columns
+
+    def _get_data_columns(self) -> list[str]:
+        return [column for column in self.columns if column != RowFingerprint.COLUMN]
 
     @classmethod
     def builder(cls) -> GoogleSheetsFileBuilder:
@@ -151,37 +236,71 @@ class GoogleSheetsFile():
 
 class GoogleSheetsFileBatch():
 
-    GOOGLE_SHEETS_CONFIG = json.loads(os.environ['GOOGLE_SHEETS_CONFIG'])
+    GOOGLE_SHEETS_CONFIG = EnvJson('GOOGLE_SHEETS_CONFIG')
+    TYPED_FETCH = os.getenv('TYPED_FETCH', 'false').lower() == 'true'
 
-    def __init__(self, datasource: MySQLDataSource, service: Resource):
+    def __init__(self, datasource: MySQLDataSource, service: Resource,
+                 change_detector: ChangeDetector=None,
+                 google_sheets_files_metadata: list[dict]=None, read_only: bool=False):
+        """google_sheets_files_metadata, when given, is used instead of the configured
+        files and is expected to be already filtered by change_detector. With
+        read_only the watermark table is neither created nor seeded"""
         self.datasource = datasource
         self.google_sheets_files: list[GoogleSheetsFile] = []
+
+        if google_sheets_files_metadata is None:
+            google_sheets_files_metadata = self.GOOGLE_SHEETS_CONFIG['google_sheets_files_metadata']
+            if change_detector is not None:
+                google_sheets_files_metadata = change_detector.filter_changed(google_sheets_files_metadata)
+
+        if len(google_sheets_files_metadata) == 0:
+            return
         
+        db_tables = [metadata['db_table'] for metadata in google_sheets_files_metadata]
+
         with self.datasource as conn:
-            for google_sheets_file_metadata in self.GOOGLE_SHEETS_CONFIG['google_sheets_files_metadata']:
-                pages_in_db = \
-                    [row[0]
-                    for row
-                    in conn.execute(
-                        self.pages_in_db_query(google_sheets_file_metadata['db_table']))
-                        .fetchall()]
-                
-                columns = \
-                    [row[0]
-                    for row
-                    in conn.execute(
-                        self.columns_from_table_query(
-                            self.datasource._DB, google_sheets_file_metadata['db_table']))
-                        .fetchall()]    
-                
-                filter_values = FilterByLastRecordedValueStrategy.get_filter_value(
-                    conn, google_sheets_file_metadata['db_table']
-                )
+            with metrics.stage('metadata_db', query='columns'):
+                columns_by_table = self.get_columns(conn, self.datasource._DB, db_tables)
+
+            with metrics.stage('metadata_db', query='filter_values'):
+                if FilterByWatermarkStrategy.ENABLED:
+                    if not read_only:
+                        FilterByWatermarkStrategy.create_table(conn)
+                    filter_values_by_table = FilterByWatermarkStrategy.get_filter_values(conn, db_tables,
+                                                                                         seed=not read_only)
+                    pages_in_db_by_table = {table: list(filter_values.keys())
+                                            for table, filter_values in filter_values_by_table.items()}
+                else:
+                    pages_in_db_by_table = {table: [] for table in db_tables}
+                    for table, page in conn.execute(self.pages_in_db_query(db_tables)).fetchall():
+                        pages_in_db_by_table[table].append(page)
+                    filter_values_by_table = {
+                        table: FilterByLastRecordedValueStrategy.get_filter_value(conn, table)
+                        for table in db_tables
+                    }
+
+            for google_sheets_file_metadata in google_sheets_files_metadata:
+                pages_in_db = pages_in_db_by_table[google_sheets_file_metadata['db_table']]
+                filter_values = filter_values_by_table[google_sheets_file_metadata['db_table']]
+                columns = columns_by_table[google_sheets_file_metadata['db_table']]
 
                 excluded_columns = (google_sheets_file_metadata.get('excluded_columns')
                                     if google_sheets_file_metadata.get('excluded_columns') is not None
                                     else self.GOOGLE_SHEETS_CONFIG['common_metadata']['excluded_columns'])
 
+                transformations_spec = (google_sheets_file_metadata.get('transformations')
+                                        if google_sheets_file_metadata.get('transformations') is not None
+                                        else self.GOOGLE_SHEETS_CONFIG['common_metadata'].get('transformations'))
+                transformations = ColumnTransformations.compile(
+                    [column for column in columns if column != RowFingerprint.COLUMN],
+                    transformations_spec
+                )
+
+                typed_fetch = google_sheets_file_metadata.get(
+                    'typed_fetch',
+                    self.GOOGLE_SHEETS_CONFIG['common_metadata'].get('typed_fetch', self.TYPED_FETCH)
+                )
+
                 self.google_sheets_files.append(
                     GoogleSheetsFile.builder()
                         .id(google_sheets_file_metadata['id'])
@@ -196,15 +315,34 @@ class GoogleSheetsFileBatch():
                         .wordpress_link(google_sheets_file_metadata['wp_link'])
                         .seminar_title(google_sheets_file_metadata['seminar'])
                         .excluded_columns(excluded_columns)
+                        .transformations(transformations)
+                        .typed_fetch(typed_fetch)
+                        .revision(change_detector.get_pending_revision(google_sheets_file_metadata['id'])
+                                  if change_detector is not None else None)
                         .build()
                 )
                 
-    def pages_in_db_query(self, db_table: str):
-        return f"SELECT DISTINCT pestania FROM {db_table}"
-    
-    def columns_from_table_query(self, database:str, db_table: str):
-        return f"""SELECT `COLUMN_NAME` 
-                FROM `INFORMATION_SCHEMA`.`COLUMNS` 
-                WHERE `TABLE_SCHEMA`='{database}' 
-                AND `TABLE_NAME`='{db_table}';
-                """
\ No newline at end of file
+    @classmethod
+    def get_columns(cls, conn: SQLAlchemyConnectionWrapper, database: str,
+                    db_tables: list[str]) -> dict[str, list[str]]:
+        """Returns the columns of every table with a single INFORMATION_SCHEMA query"""
+        columns_by_table = {db_table: [] for db_table in db_tables}
+        if len(db_tables) == 0:
+            return columns_by_table
+        for db_table, column in conn.execute(cls.columns_from_tables_query(database, db_tables)).fetchall():
+            columns_by_table[db_table].append(column)
+        return columns_by_table
+
+    @classmethod
+    def columns_from_tables_query(cls, database: str, db_tables: list[str]):
+        return f"""SELECT `TABLE_NAME`, `COLUMN_NAME`
+                FROM `INFORMATION_SCHEMA`.`COLUMNS`
+                WHERE `TABLE_SCHEMA`='{database}'
+                AND `TABLE_NAME` IN ({', '.join(f"'{db_table}'" for db_table in db_tables)})
+                ORDER BY `TABLE_NAME`, `ORDINAL_POSITION`;
+                """
+
+    @classmethod
+    def pages_in_db_query(cls, db_tables: list[str]):
+        return " UNION ALL ".join(f"(SELECT DISTINCT '{db_table}', pestania FROM {db_table})"
+                                  for db_table in db_tables)
\ No newline at end of file
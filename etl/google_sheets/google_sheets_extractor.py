@@ -1,35 +1,114 @@
+import os
+import json
+import hashlib
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 
+import httplib2
 import polars as pl
+import pyarrow as pa
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import Resource
 
 from etl.google_sheets.google_sheets import GoogleSheetsPage, GoogleSheetsFile
-from util.filter import DateTimeFilterByLastRecordedValue
+from etl.google_sheets.snapshot_cache import PageSnapshotCache
+from etl.google_sheets.request_executor import RequestExecutor, read_quota
+from etl.google_sheets.sink import Sink, MySQLSink, build_sinks
+from constant.enum import Mode
+from util.filter import DateTimeFilterByLastRecordedValue, DateTimeFilterByLookback, Watermark
+from util.fingerprint import RowFingerprint
+from util.metrics import metrics, values_size
+from util.filter_strategy import FilterByWatermarkStrategy
 from datasource.mysql import MySQLDataSource
+from datasource.connection_wrapper import SQLAlchemyConnectionWrapper
+from util.rate_limiter import AdaptiveConcurrencyLimiter
 
 
 class GoogleSheetsExtractor():
 
-    SOURCE_DATETIME_STRING_FORMAT = '%d/%m/%Y %H:%M:%S'
+    FETCH_MODE = os.getenv('FETCH_MODE', 'batch')
+    BATCH_GET_MAX_RANGES = int(os.getenv('BATCH_GET_MAX_RANGES', '50'))
+    EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', '1'))
+    TAIL_FETCH = os.getenv('TAIL_FETCH', 'true').lower() == 'true'
+    TAIL_FETCH_OVERLAP = int(os.getenv('TAIL_FETCH_OVERLAP', '10'))
+    WRITE_MODE = os.getenv('WRITE_MODE', 'file')
+    WRITE_CHUNK_SIZE = int(os.getenv('WRITE_CHUNK_SIZE', '5000'))
+    MERGE_KEY = os.getenv('MERGE_KEY', 'pestania,marca_temporal,correo').split(',')
+    SHARD_ROWS = int(os.getenv('SHARD_ROWS', '20000'))
+    SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', '4'))
+    STREAM_DECODE = os.getenv('STREAM_DECODE', 'false').lower() == 'true'
+    SNAPSHOT_CACHE_DIR = os.getenv('SNAPSHOT_CACHE_DIR', '')
+    SNAPSHOT_CACHE_MAX_BYTES = int(os.getenv('SNAPSHOT_CACHE_MAX_BYTES', str(1024 ** 3)))
+    SINKS = os.getenv('SINKS', 'mysql')
+    PARQUET_SINK_PATH = os.getenv('PARQUET_SINK_PATH', '')
     datetime_filter = DateTimeFilterByLastRecordedValue()
+    fingerprint_filter = DateTimeFilterByLookback(RowFingerprint.LOOKBACK)
 
-    def __init__(self, mysql_datasource: MySQLDataSource, service: Resource) -> None:
+    def __init__(self, mysql_datasource: MySQLDataSource, service: Resource,
+                 sinks: list[Sink]=None) -> None:
+        """Rows are written to every sink in sinks, by default the ones named in
+        SINKS. Watermarks are always kept in MySQL"""
         self.datasource = mysql_datasource
         self.service = service
+        self.sinks = (sinks if sinks is not None
+                      else build_sinks(mysql_datasource, self.SINKS, self.PARQUET_SINK_PATH))
+        if self.WRITE_MODE == 'merge' and any(not isinstance(sink, MySQLSink) for sink in self.sinks):
+            raise Exception('WRITE_MODE merge only supports the mysql sink')
+        # the last recorded values would be read from tables no sink writes to
+        if not FilterByWatermarkStrategy.ENABLED and not self._writes_to_mysql():
+            raise Exception('FILTER_STRATEGY last_recorded_value requires the mysql sink')
         self.total_new_rows = 0
+        # every file worker can fetch the shards of a page with SHARD_WORKERS threads
+        concurrency_limiter = AdaptiveConcurrencyLimiter(max(1, self.EXTRACTION_WORKERS) * max(1, self.SHARD_WORKERS))
+        # the read quota is shared with discovery and change detection
+        self.requests = RequestExecutor(read_quota, concurrency_limiter)
+        self._counter_lock = threading.Lock()
+        self._thread_local = threading.local()
+        self.snapshot_cache = (PageSnapshotCache(self.SNAPSHOT_CACHE_DIR, self.SNAPSHOT_CACHE_MAX_BYTES)
+                               if self.SNAPSHOT_CACHE_DIR else None)
+        self.replay_from_cache = False
+        # called with the connection of every write transaction before writing
+        self.write_guard = None
+        # last rows and row cursors committed per file, applied to its pages once it finishes
+        self._committed: dict[str, list[tuple[pl.DataFrame, dict[str, tuple[int, str]]]]] = {}
 
     def execute(self, *, google_sheets_file: GoogleSheetsFile=None,
-                google_sheets_files_list: list[GoogleSheetsFile]=None) -> None:
+                google_sheets_files_list: list[GoogleSheetsFile]=None,
+                replay_from_cache: bool=False) -> None:
+        """With replay_from_cache the values of every page are read from the
+        latest snapshot in the snapshot cache instead of the Sheets API"""
+        if replay_from_cache and self.snapshot_cache is None:
+            raise Exception('SNAPSHOT_CACHE_DIR must be set to replay from cache')
+        self.replay_from_cache = replay_from_cache
+
         if google_sheets_file is not None and google_sheets_files_list is not None:
             raise Exception('Only one argument must be non null')
         elif google_sheets_file is None and google_sheets_files_list is None:
             raise Exception('Only one argument must be null')
         elif google_sheets_file is not None:
+            self._check_sinks([google_sheets_file])
             self._execute_single_file(google_sheets_file)
         elif google_sheets_files_list is not None:
+            self._check_sinks(google_sheets_files_list)
             self._execute_file_list(google_sheets_files_list)
 
+    def _writes_to_mysql(self) -> bool:
+        return any(isinstance(sink, MySQLSink) for sink in self.sinks)
+
+    def _check_sinks(self, google_sheets_files: list[GoogleSheetsFile]) -> None:
+        """Fingerprints are deduplicated against the rows of the MySQL table, so
+        files with a fingerprint column can't be written to other sinks only"""
+        if self._writes_to_mysql():
+            return
+        fingerprinted = [google_sheets_file.id for google_sheets_file in google_sheets_files
+                         if google_sheets_file.has_fingerprint()]
+        if len(fingerprinted) > 0:
+            raise Exception(f"Files {', '.join(fingerprinted)} have a {RowFingerprint.COLUMN} column,"
+                            f" which requires the mysql sink")
+
     def _execute_single_file(self, google_sheets_file: GoogleSheetsFile, counter: dict=None):
         logging.info(f"{type(self).__name__} - Extraction started for file '{google_sheets_file.id}'")
 
@@ -37,105 +116,719 @@ class GoogleSheetsExtractor():
 
         file_df: pl.DataFrame = None
 
-        for i, google_sheets_page in enumerate(google_sheets_file.google_sheets_pages):
+        page_lfs: list[tuple[GoogleSheetsPage, pl.LazyFrame]] = []
+
+        row_cursors: dict[str, tuple[int, str]] = {}
+
+        with self._counter_lock:
+            self._committed[google_sheets_file.id] = []
+
+        recent_fingerprints = self._get_recent_fingerprints(google_sheets_file)
+
+        pages = [page for page in google_sheets_file.google_sheets_pages if not self._should_shard(page)]
+        sharded_pages = [page for page in google_sheets_file.google_sheets_pages if self._should_shard(page)]
+
+        for google_sheets_page in sharded_pages:
+            logging.info(f"{type(self).__name__} - Sharded extraction started for page '{google_sheets_page.title}'")
+            new_rows_per_page = self._execute_sharded_page(google_sheets_file, google_sheets_page,
+                                                           recent_fingerprints)
+            new_rows_per_file += new_rows_per_page
+            logging.info(f"{type(self).__name__} - Extraction finished for page '{google_sheets_page.title}'. {new_rows_per_page} new rows")
+
+        pages_values = self._iter_excel_values(google_sheets_file, pages)
+
+        for i, (google_sheets_page, (values, row_cursor)) in enumerate(zip(pages, pages_values)):
             if counter is None:
                 logging.info((f"{type(self).__name__} - Extraction started for page '{google_sheets_page.title}'."
-                            f" Page {i + 1}/{len(google_sheets_file.google_sheets_pages)}"))
+                            f" Page {i + 1}/{len(pages)}"))
             else:
                 logging.info((f"{type(self).__name__} - Extraction started for page '{google_sheets_page.title}'."
                             f" File {counter['current_file_idx']}/{counter['total_files']}."
-                            f" Page {i + 1}/{len(google_sheets_file.google_sheets_pages)}"))
+                            f" Page {i + 1}/{len(pages)}"))
 
-            values = self._get_excel_values(google_sheets_file.id, google_sheets_page)
+            page_row_cursors = {}
+            if row_cursor is not None and self._row_cursor_changed(google_sheets_page, row_cursor):
+                page_row_cursors[google_sheets_page.title] = row_cursor
 
-            if len(values) == 0:
+            if len(values) == 0 or len(values[0]) == 0:
+                if self.WRITE_MODE == 'stream':
+                    self._write(google_sheets_file, None, page_row_cursors)
+                else:
+                    row_cursors.update(page_row_cursors)
                 continue
 
-            if len(values[0]) == 0:
+            # transformations and filters only build the lazy plan, they run and are timed in collect
+            if self.replay_from_cache:
+                lf = self._generate_lazyframe_from_snapshot(values, google_sheets_file, google_sheets_page)
+            else:
+                lf = self._generate_lazyframe(values, google_sheets_file, google_sheets_page)
+            lf = self._filter_new_rows(lf, google_sheets_file, google_sheets_page, recent_fingerprints)
+
+            if self.WRITE_MODE == 'stream':
+                with metrics.stage('collect', file=google_sheets_file.id, page=google_sheets_page.title) as stats:
+                    df = lf.collect()
+                    stats['rows'] = df.height
+                new_rows_per_file += df.height
+                self._write_stream(google_sheets_file, google_sheets_page, df, page_row_cursors)
+                logging.info(f"{type(self).__name__} - Extraction finished for page '{google_sheets_page.title}'. {df.height} new rows")
                 continue
 
-            df = self._generate_dataframe(values, google_sheets_file, google_sheets_page)
-            df = self.datetime_filter.filter(df, google_sheets_page.filter_value, google_sheets_page.mode)
+            row_cursors.update(page_row_cursors)
+            page_lfs.append((google_sheets_page, lf))
 
-            if not df.is_empty():
-                if file_df is None:
-                    file_df = df
-                else:
-                    file_df = pl.concat([file_df, df])
+        # every page plan is optimized and run in parallel, then concatenated once
+        with metrics.stage('collect', file=google_sheets_file.id) as stats:
+            page_dfs = pl.collect_all([lf for _, lf in page_lfs]) if len(page_lfs) > 0 else []
+            stats['rows'] = sum(df.height for df in page_dfs)
 
+        for (google_sheets_page, _), df in zip(page_lfs, page_dfs):
             new_rows_per_file += df.height
-
             logging.info(f"{type(self).__name__} - Extraction finished for page '{google_sheets_page.title}'. {df.height} new rows")
 
-        self.total_new_rows += new_rows_per_file
+        non_empty_dfs = [df for df in page_dfs if not df.is_empty()]
+        if len(non_empty_dfs) > 0:
+            file_df = pl.concat(non_empty_dfs, rechunk=False)
 
-        if file_df is not None:
-            file_df.write_database(
-                google_sheets_file.db_table, self.datasource.url, if_exists='append'
-            )
+        if self.WRITE_MODE == 'merge':
+            new_rows_per_file, updated_rows = self._merge(google_sheets_file, file_df, row_cursors)
+            logging.info(f"{type(self).__name__} - {updated_rows} edited rows updated for file '{google_sheets_file.id}'")
+        else:
+            self._write(google_sheets_file, file_df, row_cursors)
+
+        with self._counter_lock:
+            self.total_new_rows += new_rows_per_file
+
+        self._advance_pages(google_sheets_file)
 
         logging.info(f"{type(self).__name__} - Extraction finished for file '{google_sheets_file.id}'. {new_rows_per_file} new rows")
 
+    def _should_shard(self, google_sheets_page: GoogleSheetsPage) -> bool:
+        """Pages with more than SHARD_ROWS rows left to read are fetched and
+        transformed in row range shards"""
+        if (self.replay_from_cache
+                or self.WRITE_MODE == 'merge'
+                or google_sheets_page.row_count is None
+                or not google_sheets_page.supports_tail_range()):
+            return False
+
+        row_cursor = self._get_row_cursor(google_sheets_page)
+        start_row = self._get_tail_start_row(row_cursor) if row_cursor is not None else 2
+        return google_sheets_page.row_count - start_row + 1 > self.SHARD_ROWS
+
+    def _execute_sharded_page(self, google_sheets_file: GoogleSheetsFile, google_sheets_page: GoogleSheetsPage,
+                              recent_fingerprints: pl.DataFrame) -> int:
+        """Fetches and transforms the shards of a page in parallel and writes them
+        in row order, one transaction per shard. The row cursor is stored with every
+        shard, so a failed backfill resumes at the last committed shard"""
+        header = self._get_range_values(google_sheets_file.id, google_sheets_page.get_header_range(),
+                                        google_sheets_file.typed_fetch)
+        header_row = [column[0] if len(column) > 0 else '' for column in header]
+        header_hash = self._hash_header(header_row)
+
+        start_row = self._get_shard_start_row(google_sheets_file, google_sheets_page, header_row, header_hash)
+        shards = iter([(shard_start, min(shard_start + self.SHARD_ROWS - 1, google_sheets_page.row_count))
+                       for shard_start in range(start_row, google_sheets_page.row_count + 1, self.SHARD_ROWS)])
+
+        new_rows = 0
+        # bounds the shards held in memory while waiting to be written in order
+        max_pending = 2 * self.SHARD_WORKERS
+
+        with ThreadPoolExecutor(max_workers=self.SHARD_WORKERS) as executor:
+            pending = deque()
+
+            def submit_next():
+                shard = next(shards, None)
+                if shard is not None:
+                    pending.append((shard, executor.submit(self._transform_shard, google_sheets_file,
+                                                           google_sheets_page, header_row, shard,
+                                                           recent_fingerprints)))
+
+            for _ in range(max_pending):
+                submit_next()
+
+            try:
+                while len(pending) > 0:
+                    (shard_start, shard_end), future = pending.popleft()
+                    df, last_row = future.result()
+                    submit_next()
+
+                    if last_row is None:
+                        continue
+
+                    self._write(google_sheets_file,
+                                df if not df.is_empty() else None,
+                                {google_sheets_page.title: (last_row, header_hash)})
+                    new_rows += df.height
+                    logging.info(f"{type(self).__name__} - Shard {shard_start}-{shard_end} of page"
+                                 f" '{google_sheets_page.title}' committed. {df.height} new rows")
+            except Exception:
+                for _, future in pending:
+                    future.cancel()
+                raise
+
+        return new_rows
+
+    def _get_shard_start_row(self, google_sheets_file: GoogleSheetsFile, google_sheets_page: GoogleSheetsPage,
+                             header_row: list[str], header_hash: str) -> int:
+        """Resumes after the row cursor only when the header is unchanged and the
+        first row to fetch follows the loaded rows, as the tail fetch does.
+        Otherwise the whole page is read again and the filters drop the rows
+        already loaded"""
+        row_cursor = self._get_row_cursor(google_sheets_page)
+        if row_cursor is None or row_cursor.header_hash != header_hash:
+            return 2
+
+        start_row = self._get_tail_start_row(row_cursor)
+        first_row = self._get_range_values(google_sheets_file.id,
+                                           google_sheets_page.get_rows_range(start_row, start_row),
+                                           google_sheets_file.typed_fetch)
+        if len(first_row) > 0:
+            values, _ = self._stitch_header(header_row, first_row)
+            if self._tail_follows_loaded_rows(values, google_sheets_file, google_sheets_page):
+                return start_row
+
+        logging.info(f"{type(self).__name__} - Rows of page '{google_sheets_page.title}' changed."
+                     f" Reading its shards from the first row")
+        return 2
+
+    def _transform_shard(self, google_sheets_file: GoogleSheetsFile, google_sheets_page: GoogleSheetsPage,
+                         header_row: list[str], shard: tuple[int, int],
+                         recent_fingerprints: pl.DataFrame) -> tuple[pl.DataFrame, int]:
+        shard_start, shard_end = shard
+        shard_range = google_sheets_page.get_rows_range(shard_start, shard_end)
+
+        # typed values are not strings, so they keep the python lists path
+        if self.STREAM_DECODE and not google_sheets_file.typed_fetch:
+            columns = self._get_range_columns(google_sheets_file.id, shard_range)
+            if len(columns) == 0:
+                return None, None
+            height = max(len(column) for column in columns)
+            lf = self._generate_lazyframe_from_arrow(header_row, columns, google_sheets_file, google_sheets_page)
+        else:
+            shard_values = self._get_range_values(google_sheets_file.id, shard_range,
+                                                  google_sheets_file.typed_fetch)
+            if len(shard_values) == 0:
+                return None, None
+            values, height = self._stitch_header(header_row, shard_values)
+            lf = self._generate_lazyframe(values, google_sheets_file, google_sheets_page)
+
+        lf = self._filter_new_rows(lf, google_sheets_file, google_sheets_page, recent_fingerprints)
+
+        with metrics.stage('collect', file=google_sheets_file.id, page=google_sheets_page.title) as stats:
+            df = lf.collect()
+            stats['rows'] = df.height
+        return df, shard_start - 1 + height
+
+    def _filter_new_rows(self, lf: pl.LazyFrame, google_sheets_file: GoogleSheetsFile,
+                         google_sheets_page: GoogleSheetsPage,
+                         recent_fingerprints: pl.DataFrame) -> pl.LazyFrame:
+        """Tables with a fingerprint column take the rows within the fingerprint
+        lookback and drop the ones already loaded with an anti join, the rest,
+        and pages whose recent rows lack fingerprints, keep the last recorded
+        value filter. In merge mode every row is kept"""
+        if self.WRITE_MODE == 'merge':
+            return (lf.with_columns(RowFingerprint.expr(['pestania', *google_sheets_file.get_google_sheets_columns()]))
+                    if google_sheets_file.has_fingerprint()
+                    else lf)
+
+        if not google_sheets_file.has_fingerprint():
+            return self.datetime_filter.filter(lf, google_sheets_page.filter_value, google_sheets_page.mode)
+
+        lf = lf.with_columns(RowFingerprint.expr(
+            ['pestania', *google_sheets_file.get_google_sheets_columns()]
+        ))
+        if (google_sheets_page.mode == Mode.INCREMENTAL
+                and not RowFingerprint.covers(recent_fingerprints, google_sheets_page.title)):
+            # rows loaded without fingerprints can't be matched, they are skipped by timestamp and email
+            lf = self.datetime_filter.filter(lf, google_sheets_page.filter_value, google_sheets_page.mode)
+        else:
+            lf = self.fingerprint_filter.filter(lf, google_sheets_page.filter_value, google_sheets_page.mode)
+
+        if google_sheets_page.mode == Mode.INCREMENTAL:
+            lf = RowFingerprint.anti_join(lf, recent_fingerprints, google_sheets_page.title)
+        return lf
+
+    def _get_recent_fingerprints(self, google_sheets_file: GoogleSheetsFile) -> pl.DataFrame:
+        if not google_sheets_file.has_fingerprint():
+            return None
+
+        filter_values = [google_sheets_page.filter_value
+                         for google_sheets_page in google_sheets_file.google_sheets_pages
+                         if google_sheets_page.mode == Mode.INCREMENTAL
+                         and google_sheets_page.filter_value is not None]
+        with metrics.stage('metadata_db', file=google_sheets_file.id, query='fingerprints'), \
+                self.datasource as conn:
+            return RowFingerprint.get_recent(conn, google_sheets_file.db_table, filter_values)
+
+    def _write(self, google_sheets_file: GoogleSheetsFile, df: pl.DataFrame,
+               row_cursors: dict[str, tuple[int, str]]) -> None:
+        """Writes df to every sink and advances the watermarks and row cursors in one
+        transaction. Staged sink output is published once the transaction commits"""
+        if df is None and not (FilterByWatermarkStrategy.ENABLED and len(row_cursors) > 0):
+            return
+
+        staged: list[tuple[Sink, object]] = []
+
+        with metrics.stage('write', file=google_sheets_file.id) as stats:
+            try:
+                with self.datasource.transaction() as conn:
+                    if self.write_guard is not None:
+                        self.write_guard(conn, google_sheets_file)
+                    if df is not None:
+                        # every sink gets the same frame, its buffers are never copied
+                        for sink in self.sinks:
+                            staged.append((sink, sink.write(google_sheets_file, df, conn)))
+                        stats['rows'] = df.height
+                        stats['bytes'] = df.estimated_size()
+                    self._update_watermarks(conn, google_sheets_file, df, row_cursors)
+            except Exception:
+                for sink, handle in staged:
+                    sink.rollback(handle)
+                raise
+
+            for sink, handle in staged:
+                sink.commit(handle)
+
+        self._record_commit(google_sheets_file, df, row_cursors)
+
+    def _merge(self, google_sheets_file: GoogleSheetsFile, df: pl.DataFrame,
+               row_cursors: dict[str, tuple[int, str]]) -> tuple[int, int]:
+        """Merges df into the table on MERGE_KEY, so rows edited in the sheet after
+        being loaded are updated, and advances the watermarks in one transaction.
+        Returns the number of inserted and updated rows"""
+        if df is None:
+            self._write(google_sheets_file, None, row_cursors)
+            return 0, 0
+
+        with metrics.stage('merge', file=google_sheets_file.id) as stats, \
+                self.datasource.transaction() as conn:
+            if self.write_guard is not None:
+                self.write_guard(conn, google_sheets_file)
+            inserted, updated = self.datasource.merge_dataframe(df, google_sheets_file.db_table,
+                                                                self.MERGE_KEY, conn,
+                                                                google_sheets_file.columns)
+            stats['rows'] = df.height
+            self._update_watermarks(conn, google_sheets_file, df, row_cursors)
+        self._record_commit(google_sheets_file, df, row_cursors)
+        return inserted, updated
+
+    def _record_commit(self, google_sheets_file: GoogleSheetsFile, df: pl.DataFrame,
+                       row_cursors: dict[str, tuple[int, str]]) -> None:
+        last_rows = FilterByWatermarkStrategy.get_last_rows(df) if df is not None else None
+        with self._counter_lock:
+            self._committed.setdefault(google_sheets_file.id, []).append((last_rows, row_cursors))
+
+    def _advance_pages(self, google_sheets_file: GoogleSheetsFile) -> None:
+        """Advances the filter values and row cursors of the pages of an extracted
+        file with what was committed, as stored in the database. Deferred until
+        the file finishes since shards still filter with the previous values"""
+        with self._counter_lock:
+            committed = self._committed.pop(google_sheets_file.id, [])
+
+        pages = {google_sheets_page.title: google_sheets_page
+                 for google_sheets_page in google_sheets_file.google_sheets_pages}
+        for last_rows, row_cursors in committed:
+            for row in (last_rows.iter_rows(named=True) if last_rows is not None else []):
+                if row['pestania'] in pages:
+                    pages[row['pestania']].advance(row['marca_temporal'], row['correo'])
+            for page, (row_cursor, header_hash) in row_cursors.items():
+                if page in pages:
+                    pages[page].advance_row_cursor(row_cursor, header_hash)
+
+    def _update_watermarks(self, conn: SQLAlchemyConnectionWrapper, google_sheets_file: GoogleSheetsFile, df: pl.DataFrame,
+                           row_cursors: dict[str, tuple[int, str]]) -> None:
+        if not FilterByWatermarkStrategy.ENABLED:
+            return
+        if df is not None:
+            FilterByWatermarkStrategy.update(conn, google_sheets_file.db_table, df)
+        FilterByWatermarkStrategy.update_row_cursors(conn, google_sheets_file.db_table, row_cursors)
+
+    def _write_stream(self, google_sheets_file: GoogleSheetsFile, google_sheets_page: GoogleSheetsPage,
+                      df: pl.DataFrame, row_cursors: dict[str, tuple[int, str]]) -> None:
+        """Writes a page in chunks of WRITE_CHUNK_SIZE rows, each one committed on its own.
+        Rows are written in marca_temporal order so the last recorded value stored
+        with every chunk is a checkpoint: a rerun after a failure treats the page
+        as incremental and only loads the rows after the last committed chunk"""
+        if df.is_empty():
+            self._write(google_sheets_file, None, row_cursors)
+            return
+
+        chunks = list(df.sort('marca_temporal', nulls_last=False).iter_slices(self.WRITE_CHUNK_SIZE))
+
+        for idx, chunk in enumerate(chunks):
+            # the row cursor only moves once the whole page is committed
+            self._write(google_sheets_file, chunk, row_cursors if idx == len(chunks) - 1 else {})
+            logging.info(f"{type(self).__name__} - Chunk {idx + 1}/{len(chunks)} of page"
+                         f" '{google_sheets_page.title}' committed. {chunk.height} rows")
+
+    def _row_cursor_changed(self, google_sheets_page: GoogleSheetsPage, row_cursor: tuple[int, str]) -> bool:
+        filter_value = google_sheets_page.filter_value
+        if not isinstance(filter_value, Watermark):
+            return True
+        return (filter_value.row_cursor, filter_value.header_hash) != row_cursor
+
     def _execute_file_list(self, google_sheets_files: list[GoogleSheetsFile]):
-        for i, file in enumerate(google_sheets_files):
-            self._execute_single_file(
-                file,
-                {'current_file_idx': i + 1, 'total_files': len(google_sheets_files)}
-            )
+        counters = [{'current_file_idx': i + 1, 'total_files': len(google_sheets_files)}
+                    for i in range(len(google_sheets_files))]
+
+        if self.EXTRACTION_WORKERS <= 1:
+            for file, counter in zip(google_sheets_files, counters):
+                self._execute_single_file(file, counter)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.EXTRACTION_WORKERS) as executor:
+            futures = [executor.submit(self._execute_single_file, file, counter)
+                       for file, counter in zip(google_sheets_files, counters)]
+            for future in futures:
+                future.result()
+
+    def _execute_request(self, request):
+        return self.requests.execute(request, http=self._get_thread_http())
+
+    def _get_thread_http(self):
+        """httplib2 is not thread safe, so every worker thread gets its own
+        authorized http object sharing the service credentials"""
+        if threading.current_thread() is threading.main_thread():
+            return self.service._http
 
-    def _get_excel_values(self, google_sheets_file_id: str,
+        if not hasattr(self._thread_local, 'http'):
+            self._thread_local.http = AuthorizedHttp(self.service._http.credentials,
+                                                     http=httplib2.Http())
+        return self._thread_local.http
+
+    def _get_excel_values(self, google_sheets_file: GoogleSheetsFile,
                           google_sheets_page: GoogleSheetsPage) -> list[list[str]]:
+        return self._get_range_values(google_sheets_file.id, google_sheets_page.get_full_range(),
+                                      google_sheets_file.typed_fetch)
+
+    def _get_range_values(self, google_sheets_file_id: str, range: str,
+                          typed: bool=False) -> list[list[str]]:
+        request = (self.service.spreadsheets()
+                    .values()
+                    .get(spreadsheetId=google_sheets_file_id,
+                        range=range,
+                        majorDimension='COLUMNS',
+                        fields="values",
+                        **self._get_render_options(typed)))
+        with metrics.stage('fetch', file=google_sheets_file_id, range=range) as stats:
+            values = self._execute_request(request).get('values', [])
+            stats['rows'], stats['bytes'] = values_size(values)
+        return values
+
+    def _get_range_columns(self, google_sheets_file_id: str, range: str) -> list[pa.Array]:
+        """Fetches a range like _get_range_values but keeps the raw response body
+        and decodes it incrementally into Arrow string arrays, one per column"""
+        from etl.google_sheets.arrow_decoder import decode_columns
+
         request = (self.service.spreadsheets()
                     .values()
                     .get(spreadsheetId=google_sheets_file_id,
-                        range=google_sheets_page.get_full_range(),
+                        range=range,
                         majorDimension='COLUMNS',
                         fields="values"))
-        response = request.execute()
-        return response.get('values', [])
-    
-    def _generate_dataframe(self, values: list[list[str]],
+        # skips the JSON model, execute returns the response body as bytes
+        request.postproc = lambda resp, content: content
+
+        with metrics.stage('fetch', file=google_sheets_file_id, range=range) as stats:
+            content = self._execute_request(request)
+            stats['bytes'] = len(content)
+        with metrics.stage('decode', file=google_sheets_file_id, range=range) as stats:
+            columns = decode_columns(content)
+            stats['rows'] = max((len(column) for column in columns), default=0)
+            stats['bytes'] = len(content)
+        return columns
+
+    def _iter_excel_values(self, google_sheets_file: GoogleSheetsFile, pages: list[GoogleSheetsPage]):
+        """Yields the values of every page of the file along with its row cursor,
+        in page order. In batch mode pages are fetched through values.batchGet in
+        chunks of at most BATCH_GET_MAX_RANGES ranges, otherwise one values.get
+        per range"""
+        if self.replay_from_cache:
+            for google_sheets_page in pages:
+                yield self._load_snapshot(google_sheets_file, google_sheets_page), None
+            return
+
+        ranges_per_page = [self._get_page_ranges(page) for page in pages]
+
+        if self.FETCH_MODE != 'batch':
+            for google_sheets_page, ranges in zip(pages, ranges_per_page):
+                yield self._resolve_page_values(
+                    google_sheets_file, google_sheets_page,
+                    [self._get_range_values(google_sheets_file.id, range, google_sheets_file.typed_fetch)
+                     for range in ranges]
+                )
+            return
+
+        for chunk in self._chunk_pages(list(zip(pages, ranges_per_page))):
+            value_ranges = self._get_excel_values_batch(
+                google_sheets_file.id, [range for _, ranges in chunk for range in ranges],
+                google_sheets_file.typed_fetch
+            )
+            idx = 0
+            for google_sheets_page, ranges in chunk:
+                yield self._resolve_page_values(
+                    google_sheets_file, google_sheets_page, value_ranges[idx:idx + len(ranges)]
+                )
+                idx += len(ranges)
+
+    def _chunk_pages(self, pages_ranges: list[tuple[GoogleSheetsPage, list[str]]]):
+        chunk, chunk_ranges = [], 0
+        for page_ranges in pages_ranges:
+            if chunk and chunk_ranges + len(page_ranges[1]) > self.BATCH_GET_MAX_RANGES:
+                yield chunk
+                chunk, chunk_ranges = [], 0
+            chunk.append(page_ranges)
+            chunk_ranges += len(page_ranges[1])
+        if chunk:
+            yield chunk
+
+    def _get_excel_values_batch(self, google_sheets_file_id: str, ranges: list[str],
+                                typed: bool=False) -> list[list[list[str]]]:
+        request = (self.service.spreadsheets()
+                    .values()
+                    .batchGet(spreadsheetId=google_sheets_file_id,
+                        ranges=ranges,
+                        majorDimension='COLUMNS',
+                        fields="valueRanges(values)",
+                        **self._get_render_options(typed)))
+        with metrics.stage('fetch', file=google_sheets_file_id, ranges=len(ranges)) as stats:
+            value_ranges = self._execute_request(request).get('valueRanges', [])
+            for value_range in value_ranges:
+                rows, size = values_size(value_range.get('values', []))
+                stats['rows'] += rows
+                stats['bytes'] += size
+        # valueRanges come back in the same order as the requested ranges
+        return [value_range.get('values', []) for value_range in value_ranges] + \
+            [[] for _ in range(len(ranges) - len(value_ranges))]
+
+    def _get_render_options(self, typed: bool) -> dict[str, str]:
+        """Typed fetches get numbers as numbers and dates as serial numbers,
+        the rest of the cells as formatted strings"""
+        if not typed:
+            return {}
+        return {'valueRenderOption': 'UNFORMATTED_VALUE', 'dateTimeRenderOption': 'SERIAL_NUMBER'}
+
+    def _get_row_cursor(self, google_sheets_page: GoogleSheetsPage) -> Watermark:
+        """Returns the stored row cursor of the page when only its tail can be fetched"""
+        filter_value = google_sheets_page.filter_value
+        if (self.TAIL_FETCH
+                and self.WRITE_MODE != 'merge'
+                and google_sheets_page.mode == Mode.INCREMENTAL
+                and self.datetime_filter.FIXED_MODE != Mode.HISTORICAL.name
+                and isinstance(filter_value, Watermark)
+                and filter_value.row_cursor is not None
+                and google_sheets_page.supports_tail_range()):
+            return filter_value
+        return None
+
+    def _get_tail_start_row(self, row_cursor: Watermark) -> int:
+        # the row at the cursor is always fetched again, it proves the tail follows loaded rows
+        return max(2, row_cursor.row_cursor + 1 - max(1, self.TAIL_FETCH_OVERLAP))
+
+    def _get_page_ranges(self, google_sheets_page: GoogleSheetsPage) -> list[str]:
+        row_cursor = self._get_row_cursor(google_sheets_page)
+        if row_cursor is None:
+            return [google_sheets_page.get_full_range()]
+        return [google_sheets_page.get_header_range(),
+                google_sheets_page.get_tail_range(self._get_tail_start_row(row_cursor))]
+
+    def _resolve_page_values(self, google_sheets_file: GoogleSheetsFile, google_sheets_page: GoogleSheetsPage,
+                             value_ranges: list[list[list[str]]]) -> tuple[list[list[str]], tuple[int, str]]:
+        """Turns the fetched ranges of a page into header + rows columnar values.
+        Tail fetches are stitched onto the header row. The tail starts at or before
+        the row cursor, so its first row was already loaded unless rows were
+        deleted. When the header changed, the tail came back empty, its first row
+        is newer than the watermark or there is no snapshot to append it to, the
+        full range is fetched instead"""
+        if len(value_ranges) == 1:
+            values = value_ranges[0]
+            return self._store_snapshot(google_sheets_file, google_sheets_page, values)
+
+        header, tail = value_ranges
+        header_row = [column[0] if len(column) > 0 else '' for column in header]
+        row_cursor = self._get_row_cursor(google_sheets_page)
+
+        reason = 'Header or rows changed'
+        if self._hash_header(header_row) == row_cursor.header_hash and len(tail) > 0:
+            values, tail_height = self._stitch_header(header_row, tail)
+            if self._tail_follows_loaded_rows(values, google_sheets_file, google_sheets_page):
+                start_row = self._get_tail_start_row(row_cursor)
+                new_row_cursor = (start_row - 1 + tail_height, self._hash_header(header_row))
+                if self._append_snapshot(google_sheets_file, google_sheets_page, start_row, values,
+                                         new_row_cursor):
+                    return values, new_row_cursor
+                reason = 'No snapshot to append the tail to'
+
+        logging.info(f"{type(self).__name__} - {reason} for page '{google_sheets_page.title}'."
+                     f" Fetching its full range")
+        values = self._get_excel_values(google_sheets_file, google_sheets_page)
+        return self._store_snapshot(google_sheets_file, google_sheets_page, values)
+
+    def _tail_follows_loaded_rows(self, values: list[list[str]], google_sheets_file: GoogleSheetsFile,
+                                  google_sheets_page: GoogleSheetsPage) -> bool:
+        """Whether the first tail row is not newer than the watermark. Otherwise
+        rows were deleted and new rows may have moved above the tail"""
+        first_row = [column[:2] for column in values]
+        timestamp = (self._generate_lazyframe(first_row, google_sheets_file, google_sheets_page)
+                     .select('marca_temporal')
+                     .collect()['marca_temporal'][0])
+        return timestamp is not None and timestamp <= google_sheets_page.filter_value.datetime_to_filter_by
+
+    def _stitch_header(self, header_row: list[str],
+                       rows_values: list[list[str]]) -> tuple[list[list[str]], int]:
+        """Prepends the header row to columnar values fetched without it, padding
+        the columns Sheets trimmed, and returns them with the number of rows"""
+        height = max(len(column) for column in rows_values)
+        values = [[column_header]
+                  + (rows_values[idx] if idx < len(rows_values) else [])
+                  + [None] * (height - (len(rows_values[idx]) if idx < len(rows_values) else 0))
+                  for idx, column_header in enumerate(header_row)]
+        return values, height
+
+    def _store_snapshot(self, google_sheets_file: GoogleSheetsFile, google_sheets_page: GoogleSheetsPage,
+                        values: list[list[str]]) -> tuple[list[list[str]], tuple[int, str]]:
+        """Stores the full values of a page in the snapshot cache, keyed by the
+        file revision or by the page row cursor when the revision is unknown"""
+        row_cursor = self._build_row_cursor(values)
+
+        if self.snapshot_cache is not None and row_cursor is not None:
+            self.snapshot_cache.store(google_sheets_file.id, google_sheets_page.title,
+                                      self._get_snapshot_revision(google_sheets_file, row_cursor), values)
+
+        return values, row_cursor
+
+    def _append_snapshot(self, google_sheets_file: GoogleSheetsFile, google_sheets_page: GoogleSheetsPage,
+                         start_row: int, values: list[list[str]], row_cursor: tuple[int, str]) -> bool:
+        """Extends the latest snapshot of a page with a stitched tail. Returns False
+        when there is no snapshot to extend, the page must then be fetched in full
+        so its snapshot holds every row"""
+        if self.snapshot_cache is None:
+            return True
+        return self.snapshot_cache.append(google_sheets_file.id, google_sheets_page.title,
+                                          self._get_snapshot_revision(google_sheets_file, row_cursor),
+                                          start_row, values)
+
+    def _get_snapshot_revision(self, google_sheets_file: GoogleSheetsFile, row_cursor: tuple[int, str]) -> str:
+        return google_sheets_file.revision or f'{row_cursor[0]}-{row_cursor[1]}'
+
+    def _load_snapshot(self, google_sheets_file: GoogleSheetsFile,
+                       google_sheets_page: GoogleSheetsPage) -> list[pa.Array]:
+        columns = self.snapshot_cache.load_latest(google_sheets_file.id, google_sheets_page.title)
+        if columns is None:
+            logging.warning(f"{type(self).__name__} - No snapshot for page '{google_sheets_page.title}'"
+                            f" of file '{google_sheets_file.id}'. Skipped")
+            return []
+        return columns
+
+    def _build_row_cursor(self, values: list[list[str]]) -> tuple[int, str]:
+        if len(values) == 0:
+            return None
+        header_row = [column[0] if len(column) > 0 else '' for column in values]
+        return max(len(column) for column in values), self._hash_header(header_row)
+
+    def _hash_header(self, header_row: list[str]) -> str:
+        return hashlib.sha1(json.dumps(header_row).encode()).hexdigest()
+
+    def _generate_lazyframe(self, values: list[list[str]],
                             google_sheets_file: GoogleSheetsFile,
-                            google_sheets_page: GoogleSheetsPage) -> pl.DataFrame:
-        columnar_values = [columnar_value[1:]
+                            google_sheets_page: GoogleSheetsPage) -> pl.LazyFrame:
+        """Builds the transformation plan of a page. Header cells are dropped with a
+        zero copy slice of each column instead of slicing the python lists"""
+        google_sheets_columns = google_sheets_file.get_google_sheets_columns()
+        transformations = google_sheets_file.get_transformations()
+        columnar_values = [columnar_value
                            for columnar_value in values
                            if columnar_value[0] not in google_sheets_file.excluded_columns]
 
-        data = {column: columnar_values[idx]
-                for (idx, column) in enumerate(google_sheets_file.get_google_sheets_columns())}
-        
-        schema =  {c: pl.Utf8 for c in google_sheets_file.get_google_sheets_columns()}
-
-        new_cols_values = [
-            google_sheets_page.title,
-            google_sheets_page.link,
-            google_sheets_file.wordpress_link,
-            google_sheets_file.seminar_title
-        ]
-        new_cols = [pl.lit(value).alias(column)
-                    for column, value
-                    in zip(google_sheets_file.get_custom_columns(),
-                            new_cols_values)]
-
-        df = (pl.DataFrame(data, schema=schema)
-                .with_columns([
-                    pl.col(f'{google_sheets_file.get_google_sheets_columns()[0]}').str
-                        .to_datetime(self.SOURCE_DATETIME_STRING_FORMAT, strict=False),
-                    pl.col(f'{google_sheets_file.get_google_sheets_columns()[1]}').str
-                        .split('/')
-                        .list
-                        .get(0)
-                        .str
-                        .strip_chars()
-                        .cast(pl.UInt8),
-                    pl.col(f'{google_sheets_file.get_google_sheets_columns()[5]}').str.replace_all(' ', ''),
-                    pl.col(f'{google_sheets_file.get_google_sheets_columns()[6]}').str.replace_all(' ', ''),
-                    *new_cols
-                ])
-                .select(
-                    '*',
-                    estado=pl.when(pl.col('puntuacion') >= 10.5)
-                        .then(pl.lit('APROBADO'))
-                        .otherwise('DESAPROBADO')))
-        return df
-    
\ No newline at end of file
+        if google_sheets_file.typed_fetch:
+            series = [self._typed_series(column, columnar_values[idx][1:],
+                                         column in transformations.numeric_columns,
+                                         google_sheets_page)
+                      for (idx, column) in enumerate(google_sheets_columns)]
+        else:
+            series = [pl.Series(column, columnar_values[idx], dtype=pl.Utf8).slice(1)
+                      for (idx, column) in enumerate(google_sheets_columns)]
+
+        return self._apply_transformations(series, google_sheets_file, google_sheets_page)
+
+    def _apply_transformations(self, series: list[pl.Series], google_sheets_file: GoogleSheetsFile,
+                               google_sheets_page: GoogleSheetsPage) -> pl.LazyFrame:
+        transformations = google_sheets_file.get_transformations()
+        context = {
+            'page_title': google_sheets_page.title,
+            'page_link': google_sheets_page.link,
+            'wordpress_link': google_sheets_file.wordpress_link,
+            'seminar_title': google_sheets_file.seminar_title
+        }
+        # the expressions are compiled once per table and shared by all its pages
+        return transformations.apply(pl.DataFrame(series).lazy(), context, google_sheets_file.typed_fetch)
+
+    def _generate_lazyframe_from_arrow(self, header_row: list[str], columns: list[pa.Array],
+                                       google_sheets_file: GoogleSheetsFile,
+                                       google_sheets_page: GoogleSheetsPage) -> pl.LazyFrame:
+        """Builds the transformation plan of a page from Arrow columns without header"""
+        series = self._arrow_series(header_row, columns, google_sheets_file)
+
+        if google_sheets_file.typed_fetch:
+            # typed values are stored in snapshots as their string form
+            numeric_columns = google_sheets_file.get_transformations().numeric_columns
+            series = [self._parse_numbers(column_series, google_sheets_page)
+                      if column_series.name in numeric_columns else column_series
+                      for column_series in series]
+        return self._apply_transformations(series, google_sheets_file, google_sheets_page)
+
+    def _arrow_series(self, header_row: list[str], columns: list[pa.Array],
+                      google_sheets_file: GoogleSheetsFile) -> list[pl.Series]:
+        """Wraps the Arrow columns in series, padding with nulls only the columns
+        Sheets trimmed. Polars shares the buffers of large_string arrays, string
+        arrays get their offsets widened into a copy"""
+        google_sheets_columns = google_sheets_file.get_google_sheets_columns()
+        height = max(len(column) for column in columns)
+        columnar_values = [(columns[idx] if idx < len(columns) else pa.nulls(0, pa.large_string()))
+                           for idx, column_header in enumerate(header_row)
+                           if column_header not in google_sheets_file.excluded_columns]
+
+        return [pl.Series(column, columnar_values[idx]
+                          if len(columnar_values[idx]) == height
+                          else pa.concat_arrays([columnar_values[idx],
+                                                 pa.nulls(height - len(columnar_values[idx]),
+                                                          columnar_values[idx].type)]))
+                for (idx, column) in enumerate(google_sheets_columns)]
+
+    def _generate_lazyframe_from_snapshot(self, columns: list[pa.Array], google_sheets_file: GoogleSheetsFile,
+                                          google_sheets_page: GoogleSheetsPage) -> pl.LazyFrame:
+        """Builds the transformation plan of a page from snapshot columns, header
+        included. Snapshots are stored padded, so the series read the memory
+        mapped buffers until the transformations produce new columns"""
+        return self._generate_lazyframe_from_arrow([column[0].as_py() for column in columns],
+                                                   [column.slice(1) for column in columns],
+                                                   google_sheets_file, google_sheets_page)
+
+    def _typed_series(self, column: str, column_values: list, numeric: bool,
+                      google_sheets_page: GoogleSheetsPage) -> pl.Series:
+        """Builds numeric columns as Float64 straight from the unformatted values
+        and the rest as strings. Cells that are not numbers in a numeric column,
+        or snapshot strings, are parsed and the ones left null are reported"""
+        # polars reads values of another type as null instead of raising, so they are checked first
+        if numeric:
+            column_values = [None if value == '' else value for value in column_values]
+            if all(value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+                   for value in column_values):
+                return pl.Series(column, column_values, dtype=pl.Float64)
+
+            return self._parse_numbers(self._typed_series(column, column_values, False, google_sheets_page),
+                                       google_sheets_page)
+
+        if all(value is None or isinstance(value, str) for value in column_values):
+            return pl.Series(column, column_values, dtype=pl.Utf8)
+        return pl.Series(column, [value if value is None or isinstance(value, str) else str(value)
+                                  for value in column_values], dtype=pl.Utf8)
+
+    def _parse_numbers(self, strings: pl.Series, google_sheets_page: GoogleSheetsPage) -> pl.Series:
+        """Parses a string column as Float64, reporting the non empty cells left null"""
+        numbers = strings.cast(pl.Float64, strict=False)
+        unparsed = numbers.null_count() - strings.null_count() - (strings == '').sum()
+        if unparsed > 0:
+            logging.warning(f"{type(self).__name__} - {unparsed} non numeric cells in column"
+                            f" '{strings.name}' of page '{google_sheets_page.title}' read as null")
+        return numbers
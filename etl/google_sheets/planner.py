@@ -0,0 +1,133 @@
+import os
+import math
+import logging
+
+from etl.google_sheets.google_sheets import GoogleSheetsPage, GoogleSheetsFile
+from etl.google_sheets.google_sheets_extractor import GoogleSheetsExtractor
+
+
+class PagePlan():
+
+    def __init__(self, google_sheets_page: GoogleSheetsPage, ranges: int, calls: int,
+                 rows: int, bytes: int, strategy: str) -> None:
+        self.google_sheets_page = google_sheets_page
+        self.ranges = ranges
+        self.calls = calls
+        self.rows = rows
+        self.bytes = bytes
+        self.strategy = strategy
+
+    def to_dict(self) -> dict:
+        return {'page': self.google_sheets_page.title,
+                'mode': self.google_sheets_page.mode.name,
+                'strategy': self.strategy,
+                'calls': self.calls,
+                'rows': self.rows,
+                'bytes': self.bytes}
+
+
+class FilePlan():
+
+    def __init__(self, google_sheets_file: GoogleSheetsFile, page_plans: list[PagePlan], calls: int) -> None:
+        self.google_sheets_file = google_sheets_file
+        self.page_plans = page_plans
+        self.calls = calls
+        self.rows = sum(page_plan.rows for page_plan in page_plans)
+        self.bytes = sum(page_plan.bytes for page_plan in page_plans)
+        self.scheduled = True
+
+    def to_dict(self) -> dict:
+        return {'file': self.google_sheets_file.id,
+                'db_table': self.google_sheets_file.db_table,
+                'scheduled': self.scheduled,
+                'calls': self.calls,
+                'rows': self.rows,
+                'bytes': self.bytes,
+                'pages': [page_plan.to_dict() for page_plan in self.page_plans]}
+
+
+class RunPlan():
+
+    def __init__(self, file_plans: list[FilePlan], max_calls: int) -> None:
+        self.file_plans = file_plans
+        self.max_calls = max_calls
+
+    def get_scheduled_files(self) -> list[GoogleSheetsFile]:
+        return [file_plan.google_sheets_file for file_plan in self.file_plans if file_plan.scheduled]
+
+    def get_deferred_files(self) -> list[GoogleSheetsFile]:
+        return [file_plan.google_sheets_file for file_plan in self.file_plans if not file_plan.scheduled]
+
+    def to_dict(self) -> dict:
+        scheduled = [file_plan for file_plan in self.file_plans if file_plan.scheduled]
+        return {'max_calls': self.max_calls,
+                'calls': sum(file_plan.calls for file_plan in scheduled),
+                'rows': sum(file_plan.rows for file_plan in scheduled),
+                'bytes': sum(file_plan.bytes for file_plan in scheduled),
+                'deferred_files': len(self.file_plans) - len(scheduled),
+                'files': [file_plan.to_dict() for file_plan in self.file_plans]}
+
+
+class RunPlanner():
+    """Estimates the Sheets calls, rows and bytes of a run from the metadata
+    already loaded by GoogleSheetsFileBatch: grid row counts, page modes and
+    row cursors. Estimates follow the fetch path the extractor will take, full
+    range, tail or shards. Grid row counts include trailing empty rows, so rows
+    are an upper bound.
+
+    Files are ordered largest first, so long files start early under parallel
+    execution, and files that don't fit in the MAX_CALLS budget are deferred to
+    the next run"""
+
+    MAX_CALLS = int(os.getenv('PLAN_MAX_CALLS', '0'))
+    AVG_CELL_BYTES = int(os.getenv('PLAN_AVG_CELL_BYTES', '24'))
+
+    def __init__(self, extractor: GoogleSheetsExtractor) -> None:
+        self.extractor = extractor
+
+    def plan(self, google_sheets_files: list[GoogleSheetsFile]) -> RunPlan:
+        file_plans = sorted([self._plan_file(google_sheets_file) for google_sheets_file in google_sheets_files],
+                            key=lambda file_plan: (file_plan.bytes, file_plan.calls), reverse=True)
+
+        if self.MAX_CALLS > 0:
+            budget = self.MAX_CALLS
+            for file_plan in file_plans:
+                if file_plan.calls > budget:
+                    file_plan.scheduled = False
+                    logging.warning(f"{type(self).__name__} - File '{file_plan.google_sheets_file.id}' deferred."
+                                    f" {file_plan.calls} estimated calls, {budget} left in the budget")
+                    continue
+                budget -= file_plan.calls
+
+        return RunPlan(file_plans, self.MAX_CALLS)
+
+    def _plan_file(self, google_sheets_file: GoogleSheetsFile) -> FilePlan:
+        columns = len(google_sheets_file.get_google_sheets_columns()) + len(google_sheets_file.excluded_columns or [])
+        page_plans = [self._plan_page(google_sheets_page, columns)
+                      for google_sheets_page in google_sheets_file.google_sheets_pages]
+
+        if self.extractor.replay_from_cache:
+            calls = 0
+        else:
+            batched_ranges = sum(page_plan.ranges for page_plan in page_plans if page_plan.strategy != 'shards')
+            if self.extractor.FETCH_MODE == 'batch':
+                batched_calls = math.ceil(batched_ranges / self.extractor.BATCH_GET_MAX_RANGES)
+            else:
+                batched_calls = batched_ranges
+            calls = batched_calls + sum(page_plan.calls for page_plan in page_plans if page_plan.strategy == 'shards')
+
+        return FilePlan(google_sheets_file, page_plans, calls)
+
+    def _plan_page(self, google_sheets_page: GoogleSheetsPage, columns: int) -> PagePlan:
+        row_count = google_sheets_page.row_count if google_sheets_page.row_count is not None else 0
+        row_cursor = self.extractor._get_row_cursor(google_sheets_page)
+        start_row = self.extractor._get_tail_start_row(row_cursor) if row_cursor is not None else 2
+        rows = max(0, row_count - start_row + 1)
+        bytes = rows * columns * self.AVG_CELL_BYTES
+
+        if self.extractor._should_shard(google_sheets_page):
+            shards = math.ceil(rows / self.extractor.SHARD_ROWS)
+            return PagePlan(google_sheets_page, shards + 1, shards + 1, rows, bytes, 'shards')
+
+        ranges = len(self.extractor._get_page_ranges(google_sheets_page))
+        return PagePlan(google_sheets_page, ranges, ranges, rows, bytes, 'tail' if ranges > 1 else 'full')
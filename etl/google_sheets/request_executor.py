@@ -0,0 +1,55 @@
+import os
+import time
+import random
+import logging
+from dotenv import load_dotenv
+
+from googleapiclient.errors import HttpError
+
+from util.rate_limiter import TokenBucketRateLimiter, AdaptiveConcurrencyLimiter
+
+
+load_dotenv()
+
+class RequestExecutor():
+    """Executes Google API requests honoring the read quota. Throttling and
+    server errors are retried with exponential backoff and, when there is a
+    concurrency limiter, shrink the number of concurrent requests"""
+
+    MAX_RETRIES = int(os.getenv('SHEETS_MAX_RETRIES', '5'))
+    RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, rate_limiter: TokenBucketRateLimiter,
+                 concurrency_limiter: AdaptiveConcurrencyLimiter=None) -> None:
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter
+
+    def execute(self, request, http=None) -> dict:
+        """http replaces the one of the request, worker threads need their own"""
+        for attempt in range(self.MAX_RETRIES + 1):
+            self.rate_limiter.acquire()
+            try:
+                if self.concurrency_limiter is None:
+                    response = request.execute(http=http)
+                else:
+                    with self.concurrency_limiter:
+                        response = request.execute(http=http)
+            except HttpError as e:
+                if e.resp.status not in self.RETRYABLE_STATUS_CODES or attempt == self.MAX_RETRIES:
+                    raise
+                if self.concurrency_limiter is not None:
+                    self.concurrency_limiter.on_throttle()
+                backoff = 2 ** attempt + random.random()
+                logging.warning(f"{type(self).__name__} - Google API responded {e.resp.status}."
+                                f" Retrying in {backoff:.2f}s (attempt {attempt + 1}/{self.MAX_RETRIES})")
+                time.sleep(backoff)
+                continue
+            if self.concurrency_limiter is not None:
+                self.concurrency_limiter.on_success()
+            return response
+
+
+# the quota is per project, every request of the process draws from the same bucket
+read_quota = TokenBucketRateLimiter(int(os.getenv('SHEETS_READ_QUOTA_PER_MINUTE', '60')))
+# discovery and change detection requests are issued one at a time
+sheets_requests = RequestExecutor(read_quota)
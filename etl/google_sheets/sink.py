@@ -0,0 +1,103 @@
+import os
+import uuid
+import shutil
+import logging
+from abc import ABC, abstractmethod
+
+import polars as pl
+import pyarrow.dataset as ds
+
+from etl.google_sheets.google_sheets import GoogleSheetsFile
+from datasource.connection_wrapper import SQLAlchemyConnectionWrapper
+from datasource.mysql import MySQLDataSource
+
+
+class Sink(ABC):
+    """Destination of the transformed rows of a file. write is called inside the
+    MySQL transaction that advances the watermarks; sinks outside MySQL stage
+    their output there and only publish it in commit, once the transaction is
+    committed, so a failed write never leaves rows the watermarks don't cover"""
+
+    @abstractmethod
+    def write(self, google_sheets_file: GoogleSheetsFile, df: pl.DataFrame,
+              conn: SQLAlchemyConnectionWrapper) -> object:
+        """Returns a handle to what was staged, passed back to commit or rollback"""
+        pass
+
+    def commit(self, staged: object) -> None:
+        pass
+
+    def rollback(self, staged: object) -> None:
+        pass
+
+
+class MySQLSink(Sink):
+
+    def __init__(self, datasource: MySQLDataSource) -> None:
+        self.datasource = datasource
+
+    def write(self, google_sheets_file: GoogleSheetsFile, df: pl.DataFrame,
+              conn: SQLAlchemyConnectionWrapper) -> object:
+        self.datasource.write_dataframe(df, google_sheets_file.db_table, conn, google_sheets_file.columns)
+
+
+class ParquetSink(Sink):
+    """Writes rows to a Parquet dataset partitioned as
+    <seminar>/pestania=<page>/fecha=<date of marca_temporal>/part-<uuid>-<i>.parquet.
+    Files are written under .staging and moved in place on commit. The frame is
+    handed to pyarrow without copying its buffers"""
+
+    DATE_COLUMN = 'fecha'
+    STAGING_DIR = '.staging'
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def write(self, google_sheets_file: GoogleSheetsFile, df: pl.DataFrame,
+              conn: SQLAlchemyConnectionWrapper) -> object:
+        table = (df.select([column for column in google_sheets_file.columns if column in df.columns])
+                   .with_columns(pl.col('marca_temporal').dt.date().alias(self.DATE_COLUMN))
+                   .to_arrow())
+
+        write_id = uuid.uuid4().hex
+        staging_path = os.path.join(self.path, self.STAGING_DIR, write_id)
+        seminar_dir = self._safe_name(google_sheets_file.seminar_title or google_sheets_file.id)
+
+        ds.write_dataset(table,
+                         os.path.join(staging_path, seminar_dir),
+                         format='parquet',
+                         partitioning=['pestania', self.DATE_COLUMN],
+                         partitioning_flavor='hive',
+                         basename_template=f'part-{write_id}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore')
+        return staging_path
+
+    def commit(self, staged: object) -> None:
+        for dirpath, _, filenames in os.walk(staged):
+            target_dir = os.path.join(self.path, os.path.relpath(dirpath, staged))
+            os.makedirs(target_dir, exist_ok=True)
+            for filename in filenames:
+                os.replace(os.path.join(dirpath, filename), os.path.join(target_dir, filename))
+        shutil.rmtree(staged, ignore_errors=True)
+
+    def rollback(self, staged: object) -> None:
+        shutil.rmtree(staged, ignore_errors=True)
+        logging.info(f'{type(self).__name__} - Staged files at {staged} discarded')
+
+    def _safe_name(self, name: str) -> str:
+        return ''.join(char if char.isalnum() or char in '-_. ' else '_' for char in name)
+
+
+def build_sinks(datasource: MySQLDataSource, sinks: str, parquet_path: str) -> list[Sink]:
+    """Builds the sinks named in a comma separated list of mysql and parquet"""
+    built = []
+    for name in (name.strip() for name in sinks.split(',')):
+        if name == 'mysql':
+            built.append(MySQLSink(datasource))
+        elif name == 'parquet':
+            if not parquet_path:
+                raise Exception('PARQUET_SINK_PATH must be set to write to the parquet sink')
+            built.append(ParquetSink(parquet_path))
+        else:
+            raise Exception(f"Unknown sink '{name}'. Sinks must be mysql or parquet")
+    return built
@@ -0,0 +1,118 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+
+import pyarrow as pa
+
+
+class PageSnapshotCache():
+    """On disk cache of the values fetched for every page, stored as Arrow IPC
+    files of large_string columns, the string type polars uses, under
+    <file id>/<page>/<revision>.arrow and read back memory mapped.
+    The least recently used snapshots are evicted once the cache grows over
+    max_bytes"""
+
+    HEADER_COLUMN_PREFIX = 'c'
+
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def store(self, google_sheets_file_id: str, page_title: str, revision: str,
+              values: list[list[str]]) -> None:
+        page_dir = self._get_page_dir(google_sheets_file_id, page_title)
+        os.makedirs(page_dir, exist_ok=True)
+
+        height = max((len(column) for column in values), default=0)
+        self._write(page_dir, revision, [self._to_string_array(column + [None] * (height - len(column)))
+                                         for column in values])
+
+    def append(self, google_sheets_file_id: str, page_title: str, revision: str, start_row: int,
+               values: list[list[str]]) -> bool:
+        """Stores a new snapshot made of the rows of the latest one before start_row
+        followed by the rows of values, a tail fetched with its header row on top.
+        Returns False, leaving the cache untouched, when there is no latest snapshot
+        or it has another header or ends before start_row"""
+        columns = self.load_latest(google_sheets_file_id, page_title)
+        if (columns is None
+                or [column[0].as_py() for column in columns] != [column[0] for column in values]
+                or len(columns[0]) < start_row - 1):
+            return False
+
+        height = max(len(column) for column in values) - 1
+        tail = [self._to_string_array(column[1:] + [None] * (height - len(column) + 1)) for column in values]
+        self._write(self._get_page_dir(google_sheets_file_id, page_title), revision,
+                    # snapshots stored as string before are widened on the way
+                    [pa.concat_arrays([column.slice(0, start_row - 1).cast(pa.large_string()), tail[idx]])
+                     for idx, column in enumerate(columns)])
+        return True
+
+    def _write(self, page_dir: str, revision: str, columns: list[pa.Array]) -> None:
+        table = pa.table({f'{self.HEADER_COLUMN_PREFIX}{idx}': column for idx, column in enumerate(columns)})
+
+        snapshot_path = os.path.join(page_dir, f'{self._safe_name(revision)}.arrow')
+        tmp_path = f'{snapshot_path}.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, snapshot_path)
+
+        self._evict()
+
+    def _to_string_array(self, column: list) -> pa.Array:
+        """Unformatted values of typed fetches are stored as their string form"""
+        try:
+            return pa.array(column, type=pa.large_string())
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return pa.array([value if value is None or isinstance(value, str) else str(value)
+                             for value in column], type=pa.large_string())
+
+    def load_latest(self, google_sheets_file_id: str, page_title: str) -> list[pa.Array]:
+        """Returns the columns of the most recent snapshot of the page, header
+        included, or None. Columns are backed by the memory mapped file and keep
+        the padding added on store"""
+        page_dir = self._get_page_dir(google_sheets_file_id, page_title)
+        if not os.path.isdir(page_dir):
+            return None
+
+        snapshots = [os.path.join(page_dir, name) for name in os.listdir(page_dir) if name.endswith('.arrow')]
+        if len(snapshots) == 0:
+            return None
+
+        snapshot_path = max(snapshots, key=os.path.getmtime)
+        # the columns reference the mapped buffers, which keep the mapping alive
+        table = pa.ipc.open_file(pa.memory_map(snapshot_path, 'r')).read_all()
+        columns = [column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+                   for column in table.columns]
+
+        # the access time marks the snapshot as recently used, the mtime keeps its revision order
+        os.utime(snapshot_path, (time.time(), os.path.getmtime(snapshot_path)))
+        return columns
+
+    def _evict(self) -> None:
+        with self._lock:
+            snapshots = []
+            for root, _, names in os.walk(self.path):
+                for name in names:
+                    if name.endswith('.arrow'):
+                        snapshot_path = os.path.join(root, name)
+                        stat = os.stat(snapshot_path)
+                        snapshots.append((max(stat.st_atime, stat.st_mtime), stat.st_size, snapshot_path))
+
+            total_bytes = sum(size for _, size, _ in snapshots)
+            for _, size, snapshot_path in sorted(snapshots):
+                if total_bytes <= self.max_bytes:
+                    break
+                os.remove(snapshot_path)
+                total_bytes -= size
+                logging.info(f"{type(self).__name__} - Snapshot '{snapshot_path}' evicted")
+
+    def _get_page_dir(self, google_sheets_file_id: str, page_title: str) -> str:
+        return os.path.join(self.path, self._safe_name(google_sheets_file_id),
+                            hashlib.sha1(page_title.encode()).hexdigest())
+
+    def _safe_name(self, name: str) -> str:
+        return ''.join(char if char.isalnum() or char in '-_' else '_' for char in name)
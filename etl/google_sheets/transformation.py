@@ -0,0 +1,163 @@
+import json
+import threading
+
+import polars as pl
+
+
+class ColumnTransformations():
+    """Column transformations of a table compiled from a declarative spec:
+
+        {"context_columns": [{"column": "pestania", "value": "page_title"}, ...],
+         "columns": [{"column": "marca_temporal", "op": "parse_datetime",
+                      "format": "%d/%m/%Y %H:%M:%S"}, ...]}
+
+    Columns are referenced by name or by position in the table columns, without
+    the row fingerprint, negative positions counting from the end. Context columns
+    take the page_title, page_link, wordpress_link or seminar_title of each page.
+    Columns written by status ops and context columns are not read from the sheet.
+
+    Ops: parse_datetime (format), split_cast (separator, index, dtype), strip,
+    remove_whitespace, cast (dtype) and status (source, threshold, then, otherwise),
+    which runs after the rest.
+
+    Expressions are compiled once per table signature, the columns and the spec,
+    and shared by every page of the table. A second set of expressions reads
+    typed values, fetched unformatted: parse_datetime columns come as serial
+    numbers and are converted arithmetically, numeric cast columns are built as
+    Float64 instead of strings"""
+
+    DEFAULT_SPEC = {
+        'context_columns': [
+            {'column': -5, 'value': 'page_title'},
+            {'column': -4, 'value': 'page_link'},
+            {'column': -3, 'value': 'wordpress_link'},
+            {'column': -2, 'value': 'seminar_title'}
+        ],
+        'columns': [
+            {'column': 1, 'op': 'parse_datetime', 'format': '%d/%m/%Y %H:%M:%S'},
+            {'column': 2, 'op': 'split_cast', 'separator': '/', 'index': 0, 'dtype': 'UInt8'},
+            {'column': 6, 'op': 'remove_whitespace'},
+            {'column': 7, 'op': 'remove_whitespace'},
+            {'column': 'estado', 'op': 'status', 'source': 'puntuacion', 'threshold': 10.5,
+             'then': 'APROBADO', 'otherwise': 'DESAPROBADO'}
+        ]
+    }
+    CONTEXT_VALUES = ('page_title', 'page_link', 'wordpress_link', 'seminar_title')
+    NUMERIC_DTYPES = ('Int8', 'Int16', 'Int32', 'Int64', 'UInt8', 'UInt16', 'UInt32', 'UInt64',
+                      'Float32', 'Float64')
+    # serial number of 1970-01-01 in the 1899-12-30 epoch used by Sheets
+    SERIAL_UNIX_EPOCH = 25569
+    MILLISECONDS_PER_DAY = 86_400_000
+
+    _cache: dict[tuple, 'ColumnTransformations'] = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, sheet_columns: list[str], context_columns: list[tuple[str, str]],
+                 expressions: list[pl.Expr], derived_columns: list[str],
+                 derived_expressions: list[pl.Expr], typed_expressions: list[pl.Expr],
+                 numeric_columns: set[str]) -> None:
+        self.sheet_columns = sheet_columns
+        self.context_columns = context_columns
+        self.expressions = expressions
+        self.derived_columns = derived_columns
+        self.derived_expressions = derived_expressions
+        self.typed_expressions = typed_expressions
+        self.numeric_columns = numeric_columns
+
+    @classmethod
+    def compile(cls, columns: list[str], spec: dict=None) -> 'ColumnTransformations':
+        """columns are the table columns without the row fingerprint, primary key first"""
+        spec = spec if spec is not None else cls.DEFAULT_SPEC
+        key = (tuple(columns), json.dumps(spec, sort_keys=True))
+
+        with cls._cache_lock:
+            if key not in cls._cache:
+                cls._cache[key] = cls._compile(columns, spec)
+            return cls._cache[key]
+
+    @classmethod
+    def _compile(cls, columns: list[str], spec: dict) -> 'ColumnTransformations':
+        context_columns = []
+        for context_column in spec.get('context_columns', []):
+            if context_column['value'] not in cls.CONTEXT_VALUES:
+                raise Exception(f"Context value must be one of {cls.CONTEXT_VALUES}, got '{context_column['value']}'")
+            context_columns.append((cls._resolve(columns, context_column['column']), context_column['value']))
+
+        expressions = []
+        derived_expressions = []
+        derived_columns = []
+        typed_expressions = []
+        numeric_columns = set()
+        for transformation in spec.get('columns', []):
+            column = cls._resolve(columns, transformation['column'])
+            if transformation['op'] == 'status':
+                derived_columns.append(column)
+                derived_expressions.append(cls._expr(column, transformation, columns))
+                continue
+
+            expressions.append(cls._expr(column, transformation, columns))
+            if transformation['op'] == 'parse_datetime':
+                numeric_columns.add(column)
+                typed_expressions.append(cls._serial_to_datetime(column))
+            else:
+                if transformation['op'] == 'cast' and transformation['dtype'] in cls.NUMERIC_DTYPES:
+                    numeric_columns.add(column)
+                typed_expressions.append(cls._expr(column, transformation, columns))
+
+        custom_columns = {column for column, _ in context_columns} | set(derived_columns)
+        sheet_columns = [column for column in columns[1:] if column not in custom_columns]
+        return cls(sheet_columns, context_columns, expressions, derived_columns, derived_expressions,
+                   typed_expressions, numeric_columns)
+
+    @classmethod
+    def _expr(cls, column: str, transformation: dict, columns: list[str]) -> pl.Expr:
+        op = transformation['op']
+        if op == 'parse_datetime':
+            return pl.col(column).str.to_datetime(transformation['format'], strict=False)
+        elif op == 'split_cast':
+            return (pl.col(column).str
+                        .split(transformation['separator'])
+                        .list
+                        .get(transformation.get('index', 0))
+                        .str
+                        .strip_chars()
+                        .cast(getattr(pl, transformation['dtype'])))
+        elif op == 'strip':
+            return pl.col(column).str.strip_chars()
+        elif op == 'remove_whitespace':
+            return pl.col(column).str.replace_all(' ', '')
+        elif op == 'cast':
+            return pl.col(column).cast(getattr(pl, transformation['dtype']), strict=False)
+        elif op == 'status':
+            return (pl.when(pl.col(cls._resolve(columns, transformation['source'])) >= transformation['threshold'])
+                        .then(pl.lit(transformation['then']))
+                        .otherwise(pl.lit(transformation['otherwise']))
+                        .alias(column))
+        raise Exception(f"Unknown column transformation op '{op}'")
+
+    @classmethod
+    def _serial_to_datetime(cls, column: str) -> pl.Expr:
+        return (((pl.col(column) - cls.SERIAL_UNIX_EPOCH) * cls.MILLISECONDS_PER_DAY)
+                    .round(0)
+                    .cast(pl.Int64)
+                    .cast(pl.Datetime('ms'))
+                    .cast(pl.Datetime('us')))
+
+    @classmethod
+    def _resolve(cls, columns: list[str], column) -> str:
+        if isinstance(column, int):
+            return columns[column]
+        if column not in columns:
+            raise Exception(f"Column '{column}' not found in table columns")
+        return column
+
+    def get_custom_columns(self) -> list[str]:
+        return [column for column, _ in self.context_columns] + self.derived_columns
+
+    def apply(self, lf: pl.LazyFrame, context: dict[str, str], typed: bool=False) -> pl.LazyFrame:
+        lf = lf.with_columns([*(self.typed_expressions if typed else self.expressions),
+                              *[pl.lit(context[value]).alias(column)
+                                for column, value in self.context_columns]])
+        if len(self.derived_expressions) > 0:
+            lf = lf.with_columns(self.derived_expressions)
+        return lf
@@ -0,0 +1,145 @@
+import os
+import uuid
+import random
+import signal
+import socket
+import logging
+import threading
+
+from googleapiclient.discovery import Resource
+
+from datasource.mysql import MySQLDataSource
+from datasource.connection_wrapper import SQLAlchemyConnectionWrapper
+from etl.google_sheets.google_sheets import GoogleSheetsFile, GoogleSheetsFileBatch
+from etl.google_sheets.google_sheets_extractor import GoogleSheetsExtractor
+from etl.google_sheets.change_detection import ChangeDetector
+from util.lease import TableLease
+
+
+class LeaseLostException(Exception):
+    pass
+
+
+class GoogleSheetsWorker():
+    """Worker mode. Several workers, in one or many hosts, share the configured
+    spreadsheets by claiming their destination tables from TableLease, so every
+    table is loaded by a single worker. While a table is processed its lease is
+    renewed by a heartbeat thread, and every write checks the lease is still
+    held in the same transaction. A worker exits once every table was completed
+    within LEASE_REFRESH_SECONDS, by itself or by others, or failed in it.
+
+        python main.py --worker & python main.py --worker & python main.py --worker"""
+
+    LEASE_SECONDS = int(os.getenv('LEASE_SECONDS', '300'))
+    LEASE_REFRESH_SECONDS = int(os.getenv('LEASE_REFRESH_SECONDS', '600'))
+
+    def __init__(self, datasource: MySQLDataSource, service: Resource,
+                 change_detector: ChangeDetector=None) -> None:
+        self.datasource = datasource
+        self.service = service
+        self.change_detector = change_detector
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.extractor = GoogleSheetsExtractor(datasource, service)
+        self.extractor.write_guard = self._check_lease
+        self._stop = threading.Event()
+
+        self.metadata_by_table: dict[str, list[dict]] = {}
+        for google_sheets_file_metadata in GoogleSheetsFileBatch.GOOGLE_SHEETS_CONFIG['google_sheets_files_metadata']:
+            self.metadata_by_table.setdefault(google_sheets_file_metadata['db_table'], []).append(
+                google_sheets_file_metadata
+            )
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+
+        with self.datasource as conn:
+            TableLease.create_table(conn)
+
+        logging.info(f"{type(self).__name__} - Worker '{self.owner}' started with"
+                     f" {len(self.metadata_by_table)} tables")
+
+        failed: set[str] = set()
+        while not self._stop.is_set():
+            # workers walk the tables from different offsets to avoid contending for the same ones
+            db_tables = list(self.metadata_by_table.keys())
+            offset = random.randrange(len(db_tables)) if len(db_tables) > 0 else 0
+            db_tables = db_tables[offset:] + db_tables[:offset]
+
+            claimed = 0
+            for db_table in db_tables:
+                if self._stop.is_set() or db_table in failed:
+                    continue
+                if not self._claim(db_table):
+                    continue
+                claimed += 1
+                if not self._process(db_table):
+                    failed.add(db_table)
+
+            if claimed > 0:
+                continue
+
+            with self.datasource as conn:
+                completed = TableLease.get_completed(conn, db_tables, self.LEASE_REFRESH_SECONDS)
+            pending = [db_table for db_table in db_tables if db_table not in completed and db_table not in failed]
+            if len(pending) == 0:
+                break
+
+            # the rest are leased by other workers, their leases are reclaimed once they expire
+            logging.info(f"{type(self).__name__} - {len(pending)} tables leased by other workers")
+            self._stop.wait(self.LEASE_SECONDS / 3)
+
+        logging.info(f"{type(self).__name__} - Worker '{self.owner}' finished. {len(failed)} tables failed")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _claim(self, db_table: str) -> bool:
+        with self.datasource.transaction() as conn:
+            return TableLease.claim(conn, db_table, self.owner, self.LEASE_SECONDS, self.LEASE_REFRESH_SECONDS)
+
+    def _process(self, db_table: str) -> bool:
+        logging.info(f"{type(self).__name__} - Table '{db_table}' claimed")
+        lease_done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(db_table, lease_done), daemon=True)
+        heartbeat.start()
+
+        completed = False
+        try:
+            google_sheets_files_metadata = self.metadata_by_table[db_table]
+            if self.change_detector is not None:
+                google_sheets_files_metadata = self.change_detector.filter_changed(google_sheets_files_metadata)
+
+            if len(google_sheets_files_metadata) > 0:
+                google_sheets_file_batch = GoogleSheetsFileBatch(self.datasource, self.service,
+                                                                 self.change_detector,
+                                                                 google_sheets_files_metadata)
+                self.extractor.execute(google_sheets_files_list=google_sheets_file_batch.google_sheets_files)
+                if self.change_detector is not None:
+                    self.change_detector.commit()
+            completed = True
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            lease_done.set()
+            heartbeat.join()
+            with self.datasource.transaction() as conn:
+                TableLease.release(conn, db_table, self.owner, completed)
+
+        logging.info(f"{type(self).__name__} - Table '{db_table}' {'completed' if completed else 'failed'}")
+        return completed
+
+    def _heartbeat(self, db_table: str, lease_done: threading.Event) -> None:
+        while not lease_done.wait(self.LEASE_SECONDS / 3):
+            try:
+                with self.datasource.transaction() as conn:
+                    if not TableLease.heartbeat(conn, db_table, self.owner, self.LEASE_SECONDS):
+                        logging.error(f"{type(self).__name__} - Lease of table '{db_table}' lost")
+                        return
+            except Exception as e:
+                logging.exception(e)
+
+    def _check_lease(self, conn: SQLAlchemyConnectionWrapper, google_sheets_file: GoogleSheetsFile) -> None:
+        if not TableLease.is_held(conn, google_sheets_file.db_table, self.owner):
+            raise LeaseLostException(f"Lease of table '{google_sheets_file.db_table}' is no longer held"
+                                     f" by '{self.owner}'")
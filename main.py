@@ -1,56 +1,248 @@
+import time
+
+PROCESS_START = time.perf_counter()
+
 import os
+import json
+import argparse
 import logging
+import threading
 from dotenv import load_dotenv
-import json
-
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-import google.cloud.logging
-
-from etl.google_sheets.google_sheets_extractor import GoogleSheetsExtractor
-from etl.google_sheets.google_sheets import GoogleSheetsFileBatch
 from datetime import datetime as dt
-from datasource.mysql import MySQLDataSource
+
+from util.config import Config
+from util.metrics import metrics, ProfilerHook
 
 load_dotenv()
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Google Forms responses ETL')
+    parser.add_argument('--rebuild-watermarks', action='store_true',
+                        help='seed the watermark table from the data already loaded and exit')
+    parser.add_argument('--replay-from-cache', action='store_true',
+                        help='read page values from the snapshot cache instead of the Sheets API')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running and poll every spreadsheet on its own adaptive interval')
+    parser.add_argument('--worker', action='store_true',
+                        help='share the spreadsheets with other workers through the lease table')
+    parser.add_argument('--plan', action='store_true',
+                        help='print the estimated calls, rows and bytes of the run and exit')
+    return parser.parse_args()
+
+def setup_cloud_logging() -> threading.Thread:
+    """Attaches Cloud Logging in the background so the client creation does not
+    delay the run. Records logged before it is attached only go to stderr"""
+    if os.getenv('CLOUD_LOGGING', 'true').lower() != 'true':
+        return None
+
+    def setup():
+        import google.cloud.logging
+        google.cloud.logging.Client().setup_logging()
+
+    thread = threading.Thread(target=setup, daemon=True)
+    thread.start()
+    return thread
+
+def build_mysql_datasource():
+    from datasource.mysql import MySQLDataSource
+
+    return MySQLDataSource(os.environ['DB_HOST'],
+                           os.environ['DB_USER'],
+                           os.environ['DB_PASSWORD'],
+                           os.environ['DB_DATABASE'],
+                           pool_size=int(os.getenv('DB_POOL_SIZE', '5')),
+                           pool_recycle=int(os.getenv('DB_POOL_RECYCLE', '3600')),
+                           write_method=os.getenv('DB_WRITE_METHOD', 'executemany'))
+
+def rebuild_watermarks(mysql_datasource) -> None:
+    from util.filter_strategy import FilterByWatermarkStrategy
+
+    with mysql_datasource as conn:
+        FilterByWatermarkStrategy.create_table(conn)
+        for google_sheets_file_metadata in Config.GOOGLE_SHEETS_CONFIG['google_sheets_files_metadata']:
+            FilterByWatermarkStrategy.rebuild(conn, google_sheets_file_metadata['db_table'])
+
+def check_schema(mysql_datasource) -> None:
+    """SCHEMA_CHECK=report logs the tables missing the index the metadata queries
+    need and the queries that scan whole tables, SCHEMA_CHECK=create also adds
+    the missing indexes online"""
+    schema_check = os.getenv('SCHEMA_CHECK', 'none')
+    if schema_check == 'none':
+        return
+
+    from datasource.index_check import TableIndexCheck
+    from etl.google_sheets.google_sheets import GoogleSheetsFileBatch
+    from util.filter_strategy import FilterByLastRecordedValueStrategy
+    from util.fingerprint import RowFingerprint
+
+    db_tables = list(dict.fromkeys(google_sheets_file_metadata['db_table']
+                                   for google_sheets_file_metadata
+                                   in Config.GOOGLE_SHEETS_CONFIG['google_sheets_files_metadata']))
+
+    with metrics.stage('metadata_db', query='schema_check'), mysql_datasource as conn:
+        columns_by_table = GoogleSheetsFileBatch.get_columns(conn, mysql_datasource._DB, db_tables)
+        queries = {db_table: [(FilterByLastRecordedValueStrategy._query(db_table), None),
+                              (GoogleSheetsFileBatch.pages_in_db_query([db_table]), None)]
+                   for db_table in db_tables}
+        # only tables with the fingerprint column run its lookup
+        for db_table in db_tables:
+            if RowFingerprint.COLUMN in columns_by_table[db_table]:
+                queries[db_table].append((RowFingerprint._recent_query(db_table, 1),
+                                          {'pestania_0': '', 'desde_0': dt.now()}))
+
+        TableIndexCheck(create_missing=schema_check == 'create').check(conn, mysql_datasource._DB,
+                                                                        db_tables, queries)
+
+def build_change_detector(gsheets_service, credentials):
+    from googleapiclient.discovery import build
+    from etl.google_sheets.change_detection import (ChangeDetector, DriveModifiedTimeRevisionSource,
+                                                    SheetsGridRevisionSource)
+
+    change_detection = os.getenv('CHANGE_DETECTION', 'none')
+    state_path = os.getenv('CHANGE_DETECTION_STATE_FILE',
+                           os.path.join(os.getcwd(), '.forms_etl_state.json'))
+
+    if change_detection == 'drive':
+        drive_service = build('drive', 'v3', credentials=credentials,
+                              static_discovery=True, cache_discovery=False)
+        return ChangeDetector(DriveModifiedTimeRevisionSource(drive_service), state_path)
+
+    if change_detection == 'sheets':
+        return ChangeDetector(SheetsGridRevisionSource(gsheets_service), state_path)
+
+    return None
+
+def setup_metrics() -> None:
+    if os.getenv('PROFILE_STAGE'):
+        metrics.add_hook(ProfilerHook(os.environ['PROFILE_STAGE'],
+                                      os.getenv('PROFILE_OUTPUT', f"{os.environ['PROFILE_STAGE']}.prof")))
+
+def export_metrics() -> None:
+    if os.getenv('METRICS_JSON_FILE'):
+        metrics.write_json(os.environ['METRICS_JSON_FILE'])
+    if os.getenv('METRICS_PROMETHEUS_FILE'):
+        metrics.write_prometheus(os.environ['METRICS_PROMETHEUS_FILE'])
+
 def main() -> None:
     start = dt.now()
+    args = parse_args()
 
     logging.basicConfig(level=logging.INFO,
                         format='%(levelname)s - %(asctime)s - %(message)s')
-    client = google.cloud.logging.Client()
-    client.setup_logging()
+    cloud_logging_thread = setup_cloud_logging()
 
     logging.info(f'main - Execution started at {start}')
 
+    mysql_datasource = None
+    extractor = None
+    setup_metrics()
+
     try:
+        # heavy modules are only imported once they are needed
+        imports_start = time.perf_counter()
+        from googleapiclient.discovery import build
+        from google.oauth2 import service_account
+        logging.info(f'main - Google client imported in {time.perf_counter() - imports_start:.3f}s')
 
         CREDENTIALS_FILE = os.path.join(os.getcwd(), 'educared-datos-forms-etl-sa.json')
 
         credentials = service_account.Credentials.from_service_account_file(
             CREDENTIALS_FILE)
         
-        with build('sheets', 'v4', credentials=credentials) as gsheets_service:
+        # the discovery document bundled with the client avoids fetching it on every run
+        with build('sheets', 'v4', credentials=credentials,
+                   static_discovery=True, cache_discovery=False) as gsheets_service:
+
+            logging.info(f'main - Startup took {time.perf_counter() - PROCESS_START:.3f}s')
+
+            if args.rebuild_watermarks:
+                mysql_datasource = build_mysql_datasource()
+                rebuild_watermarks(mysql_datasource)
+                return
+
+            google_sheets_files_metadata = Config.GOOGLE_SHEETS_CONFIG['google_sheets_files_metadata']
+            change_detector = (None if args.replay_from_cache
+                               else build_change_detector(gsheets_service, credentials))
 
-            mysql_datasource = MySQLDataSource(os.environ['DB_HOST'],
-                                            os.environ['DB_USER'],
-                                            os.environ['DB_PASSWORD'],
-                                            os.environ['DB_DATABASE'])
+            if args.daemon:
+                from etl.google_sheets.daemon import GoogleSheetsDaemon
+                mysql_datasource = build_mysql_datasource()
+                check_schema(mysql_datasource)
+                daemon = GoogleSheetsDaemon(mysql_datasource, gsheets_service, change_detector)
+                extractor = daemon.extractor
+                daemon.run()
+                return
 
-            google_sheets_file_batch = GoogleSheetsFileBatch(mysql_datasource, gsheets_service)    
+            if args.worker:
+                from etl.google_sheets.worker import GoogleSheetsWorker
+                mysql_datasource = build_mysql_datasource()
+                check_schema(mysql_datasource)
+                worker = GoogleSheetsWorker(mysql_datasource, gsheets_service, change_detector)
+                extractor = worker.extractor
+                worker.run()
+                return
+
+            if change_detector is not None:
+                google_sheets_files_metadata = change_detector.filter_changed(google_sheets_files_metadata)
+                if len(google_sheets_files_metadata) == 0:
+                    logging.info('main - No spreadsheet changed since the last run')
+                    return
+
+            imports_start = time.perf_counter()
+            from etl.google_sheets.google_sheets_extractor import GoogleSheetsExtractor
+            from etl.google_sheets.google_sheets import GoogleSheetsFileBatch
+            from etl.google_sheets.planner import RunPlanner
+            logging.info(f'main - ETL modules imported in {time.perf_counter() - imports_start:.3f}s')
+
+            mysql_datasource = build_mysql_datasource()
+            # plans only read, the schema and the watermarks are left untouched
+            if not args.plan:
+                check_schema(mysql_datasource)
+
+            google_sheets_file_batch = GoogleSheetsFileBatch(mysql_datasource, gsheets_service,
+                                                             change_detector,
+                                                             google_sheets_files_metadata,
+                                                             read_only=args.plan)
 
             extractor = GoogleSheetsExtractor(mysql_datasource, gsheets_service)
+            # estimates depend on the fetch path, which depends on replaying from cache
+            extractor.replay_from_cache = args.replay_from_cache
+            with metrics.stage('plan'):
+                plan = RunPlanner(extractor).plan(google_sheets_file_batch.google_sheets_files)
+
+            if args.plan:
+                print(json.dumps(plan.to_dict(), indent=2))
+                return
+
+            run_estimate = plan.to_dict()
+            logging.info(f"main - Run planned. {run_estimate['calls']} calls, {run_estimate['rows']} rows,"
+                         f" {run_estimate['bytes']} bytes estimated. {run_estimate['deferred_files']} files deferred")
+
             extractor.execute(
-                google_sheets_files_list=google_sheets_file_batch.google_sheets_files
+                google_sheets_files_list=plan.get_scheduled_files(),
+                replay_from_cache=args.replay_from_cache
             )
 
+            if change_detector is not None:
+                change_detector.discard([google_sheets_file.id for google_sheets_file in plan.get_deferred_files()])
+                change_detector.commit()
+
     except Exception as e:
         logging.exception(e)
 
-    end = dt.now()
-    logging.info(f'main - Execution finished at {end}.')
-    logging.info(f'main - Execution duration of {end - start}.')
-    logging.info(f'main - {extractor.total_new_rows} total new rows.')
+    finally:
+        if mysql_datasource is not None:
+            mysql_datasource.dispose()
+
+        end = dt.now()
+        logging.info(f'main - Execution finished at {end}.')
+        logging.info(f'main - Execution duration of {end - start}.')
+        if extractor is not None:
+            logging.info(f'main - {extractor.total_new_rows} total new rows.')
+        export_metrics()
+
+        if cloud_logging_thread is not None:
+            # lets the last records reach Cloud Logging
+            cloud_logging_thread.join()
 
-main()
\ No newline at end of file
+main()
@@ -0,0 +1,114 @@
+"""Stand ins for the Sheets v4 Resource and the files and pages shared by the tests"""
+import re
+from datetime import datetime as dt
+
+from etl.google_sheets.google_sheets import GoogleSheetsFile, GoogleSheetsPage
+from etl.google_sheets.google_sheets_extractor import GoogleSheetsExtractor
+from constant.enum import Mode
+from util.filter import Watermark
+
+
+HEADER = ['Marca temporal', 'Puntuación', 'Dirección de correo electrónico',
+          'Nombres', 'Apellidos', 'DNI', 'Teléfono']
+
+TYPED_VALUES = [
+    ['Marca temporal', 45123.5, 45124.25],
+    ['Puntuación', '15 / 20', '9 / 20'],
+    ['Dirección de correo electrónico', 'a@example.com', 'b@example.com'],
+    ['Nombres', 'Ana', 'Luis'],
+    ['Apellidos', 'Pérez', 'Gómez'],
+    ['DNI', 12345678, 87654321],
+    ['Teléfono', 912345678, 998765432],
+]
+
+
+class FakeHttp():
+    """Worker threads build their authorized http from these credentials"""
+    credentials = None
+
+
+class TypedRequest():
+
+    def __init__(self, service: 'TypedSheetsService', kwargs: dict) -> None:
+        self.service = service
+        self.kwargs = kwargs
+
+    def execute(self, http=None, num_retries: int=0):
+        self.service.requests.append(self.kwargs)
+        return {'values': TYPED_VALUES}
+
+
+class TypedSheetsService():
+    """Serves an unformatted values.get payload, numbers as numbers"""
+
+    def __init__(self) -> None:
+        self._http = FakeHttp()
+        self.requests = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, **kwargs):
+        return TypedRequest(self, kwargs)
+
+
+class RangeRequest():
+
+    def __init__(self, service: 'RowsSheetsService', range: str) -> None:
+        self.service = service
+        self.range = range
+
+    def execute(self, http=None, num_retries: int=0):
+        self.service.ranges.append(self.range)
+        start_row, end_row = re.match(r'.*![A-Z]+(\d*):[A-Z]+(\d*)$', self.range).groups()
+        sheet = [HEADER] + self.service.rows
+        sheet = sheet[int(start_row) - 1 if start_row else 0:int(end_row) if end_row else None]
+        return {'values': [list(column) for column in zip(*sheet)]}
+
+
+class RowsSheetsService():
+    """Serves the ranges of a single formatted page held as rows"""
+
+    def __init__(self, rows: list[list[str]]) -> None:
+        self._http = FakeHttp()
+        self.rows = rows
+        self.ranges = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId: str, range: str, **kwargs):
+        return RangeRequest(self, range)
+
+
+def build_row(day: int) -> list[str]:
+    return [f'{day:02d}/07/2023 10:00:00', '15 / 20', f'{day}@example.com',
+            'Ana', 'Pérez', '12345678', '912345678']
+
+
+def build_watermark(extractor: GoogleSheetsExtractor, row_cursor: int) -> Watermark:
+    """Watermark of a page loaded up to the 5th of July, at row_cursor"""
+    return Watermark(dt(2023, 7, 5, 10), 'Hoja 1', [], row_cursor, extractor._hash_header(HEADER))
+
+
+def build_file(filter_value: Watermark=None,
+               typed_fetch: bool=False) -> tuple[GoogleSheetsFile, GoogleSheetsPage]:
+    """A file with a single page, incremental when it has a filter value"""
+    page = GoogleSheetsPage('Hoja 1', 'A:G', Mode.HISTORICAL if filter_value is None else Mode.INCREMENTAL,
+                            'file', 0, filter_value)
+    return (GoogleSheetsFile.builder()
+                .id('file')
+                .db_table('respuestas')
+                .columns(['id', 'marca_temporal', 'puntuacion', 'correo', 'nombres', 'apellidos', 'dni',
+                          'telefono', 'pestania', 'link_pestania', 'link_wordpress', 'seminario', 'estado'])
+                .wordpress_link('https://example.com')
+                .seminar_title('Seminario')
+                .excluded_columns([])
+                .typed_fetch(typed_fetch)
+                .build()), page
@@ -0,0 +1,30 @@
+from datetime import datetime as dt
+
+from etl.google_sheets.daemon import FileSchedule
+from etl.google_sheets.google_sheets import GoogleSheetsFile, GoogleSheetsPage
+from constant.enum import Mode
+from util.filter import Watermark
+
+
+def test_kept_file_is_not_discovered_again_after_new_responses():
+    # Forms grows the grid exactly to the last response
+    page = GoogleSheetsPage('Hoja 1', 'A:G', Mode.INCREMENTAL, 'file', 0,
+                            Watermark(dt(2023, 7, 5, 10), 'Hoja 1', [], 7, 'hash'), row_count=7)
+    schedule = FileSchedule({}, 60)
+    schedule.keep(GoogleSheetsFile(google_sheets_pages=[page]))
+
+    page.advance_row_cursor(9, 'hash')
+
+    assert page.row_count == 9
+    assert not schedule.needs_discovery()
+
+
+def test_changed_header_is_discovered_again():
+    page = GoogleSheetsPage('Hoja 1', 'A:G', Mode.INCREMENTAL, 'file', 0,
+                            Watermark(dt(2023, 7, 5, 10), 'Hoja 1', [], 7, 'hash'), row_count=7)
+    schedule = FileSchedule({}, 60)
+    schedule.keep(GoogleSheetsFile(google_sheets_pages=[page]))
+
+    page.advance_row_cursor(9, 'other hash')
+
+    assert schedule.needs_discovery()
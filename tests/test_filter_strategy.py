@@ -0,0 +1,46 @@
+import json
+from datetime import datetime as dt
+
+import polars as pl
+
+from util.filter_strategy import FilterByWatermarkStrategy
+
+
+class RecordingConnection():
+
+    def __init__(self) -> None:
+        self.executed = []
+
+    def execute(self, query: str, params=None):
+        self.executed.append((query, params))
+
+
+ROWS = pl.DataFrame([('Hoja 1', dt(2023, 7, 5, 10), 'a@example.com'),
+                     ('Hoja 1', dt(2023, 7, 5, 11), 'b@example.com'),
+                     ('Hoja 1', dt(2023, 7, 5, 11), 'c@example.com'),
+                     ('Hoja 1', dt(2023, 7, 5, 11), 'b@example.com'),
+                     ('Hoja 1', None, 'd@example.com'),
+                     ('Hoja 2', dt(2023, 7, 4, 10), 'e@example.com')],
+                    schema={'pestania': pl.Utf8, 'marca_temporal': pl.Datetime, 'correo': pl.Utf8},
+                    orient='row')
+
+
+def test_last_rows_keep_every_email_tied_at_the_last_timestamp():
+    last_rows = {row['pestania']: row for row in FilterByWatermarkStrategy.get_last_rows(ROWS).iter_rows(named=True)}
+
+    assert last_rows['Hoja 1']['marca_temporal'] == dt(2023, 7, 5, 11)
+    assert sorted(last_rows['Hoja 1']['correo']) == ['b@example.com', 'c@example.com']
+    assert last_rows['Hoja 2']['correo'] == ['e@example.com']
+
+
+def test_update_merges_the_emails_of_equal_timestamps():
+    conn = RecordingConnection()
+
+    FilterByWatermarkStrategy.update(conn, 'respuestas', ROWS)
+
+    (query, params), = conn.executed
+    hoja_1, = [param for param in params if param['pestania'] == 'Hoja 1']
+    assert sorted(json.loads(hoja_1['correos'])) == ['b@example.com', 'c@example.com']
+    # the stored emails are merged on ties, which needs the stored marca_temporal before it is advanced
+    merge = query.index('WHEN VALUES(marca_temporal) = marca_temporal THEN JSON_MERGE_PRESERVE(correos, VALUES(correos))')
+    assert merge < query.index('marca_temporal = GREATEST(marca_temporal, VALUES(marca_temporal))')
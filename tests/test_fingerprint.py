@@ -0,0 +1,59 @@
+from datetime import datetime as dt, timedelta
+
+import polars as pl
+
+from constant.enum import Mode
+from util.filter import DateTimeFilterByLookback, Watermark
+from util.fingerprint import RowFingerprint
+
+
+def build_rows(rows: list[tuple[str, dt, str]]) -> pl.LazyFrame:
+    return (pl.LazyFrame(rows, schema={'pestania': pl.Utf8, 'marca_temporal': pl.Datetime, 'correo': pl.Utf8},
+                         orient='row')
+              .with_columns(RowFingerprint.expr(['pestania', 'marca_temporal', 'correo'])))
+
+
+def fingerprints(rows: list[tuple[str, dt, str]]) -> pl.DataFrame:
+    return build_rows(rows).select('pestania', RowFingerprint.COLUMN).collect()
+
+
+def test_anti_join_drops_loaded_and_repeated_rows():
+    loaded = ('Hoja 1', dt(2023, 7, 5, 10), 'a@example.com')
+    new = ('Hoja 1', dt(2023, 7, 5, 11), 'b@example.com')
+
+    df = RowFingerprint.anti_join(build_rows([loaded, new, new]), fingerprints([loaded]), 'Hoja 1').collect()
+
+    assert df.select('pestania', 'marca_temporal', 'correo').rows() == [new]
+
+
+def test_anti_join_keeps_rows_without_a_recent_fingerprint():
+    # loaded before the lookback window, so get_recent did not return it
+    old = ('Hoja 1', dt(2023, 7, 1, 10), 'a@example.com')
+    # the same answers on another page are another row
+    recent = fingerprints([('Hoja 2', dt(2023, 7, 5, 10), 'b@example.com')])
+
+    df = RowFingerprint.anti_join(build_rows([old, ('Hoja 1', dt(2023, 7, 5, 10), 'b@example.com')]),
+                                  recent, 'Hoja 1').collect()
+
+    assert df.height == 2
+
+
+def test_lookback_keeps_late_rows_within_the_window():
+    watermark = Watermark(dt(2023, 7, 5, 10), 'Hoja 1', ['a@example.com'])
+    late = ('Hoja 1', dt(2023, 7, 5, 9), 'c@example.com')
+    too_old = ('Hoja 1', dt(2023, 7, 4, 9), 'd@example.com')
+
+    df = (DateTimeFilterByLookback(timedelta(days=1))
+          .filter(build_rows([late, too_old]), watermark, Mode.INCREMENTAL)
+          .collect())
+
+    assert df.select('pestania', 'marca_temporal', 'correo').rows() == [late]
+
+
+def test_covers_only_pages_whose_recent_rows_have_fingerprints():
+    recent = pl.DataFrame({'pestania': ['Hoja 1', 'Hoja 2', 'Hoja 2'], RowFingerprint.COLUMN: [1, 2, None]},
+                          schema={'pestania': pl.Utf8, RowFingerprint.COLUMN: pl.UInt64})
+
+    assert RowFingerprint.covers(recent, 'Hoja 1')
+    assert not RowFingerprint.covers(recent, 'Hoja 2')
+    assert RowFingerprint.covers(recent, 'Hoja 3')
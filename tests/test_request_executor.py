@@ -0,0 +1,68 @@
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from etl.google_sheets import request_executor
+from etl.google_sheets.change_detection import SheetsGridRevisionSource
+from util.rate_limiter import TokenBucketRateLimiter, AdaptiveConcurrencyLimiter
+
+
+class FailingRequest():
+    """Responds with the given statuses before returning response"""
+
+    def __init__(self, statuses: list[int], response: dict) -> None:
+        self.statuses = list(statuses)
+        self.response = response
+        self.calls = 0
+
+    def execute(self, http=None, num_retries: int=0):
+        self.calls += 1
+        if len(self.statuses) > 0:
+            raise HttpError(httplib2.Response({'status': self.statuses.pop(0)}), b'')
+        return self.response
+
+
+class GridSheetsService():
+
+    def __init__(self, request: FailingRequest) -> None:
+        self.request = request
+
+    def spreadsheets(self):
+        return self
+
+    def get(self, spreadsheetId: str, fields: str):
+        return self.request
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(request_executor.time, 'sleep', lambda seconds: None)
+
+
+def test_throttled_requests_are_retried_and_shrink_concurrency():
+    concurrency_limiter = AdaptiveConcurrencyLimiter(8)
+    executor = request_executor.RequestExecutor(TokenBucketRateLimiter(600), concurrency_limiter)
+    request = FailingRequest([429, 503], {'values': []})
+
+    assert executor.execute(request) == {'values': []}
+    assert request.calls == 3
+    assert concurrency_limiter.limit == 2
+
+
+def test_client_errors_are_not_retried():
+    executor = request_executor.RequestExecutor(TokenBucketRateLimiter(600))
+    request = FailingRequest([403], {})
+
+    with pytest.raises(HttpError):
+        executor.execute(request)
+    assert request.calls == 1
+
+
+def test_change_detection_retries_server_errors():
+    request = FailingRequest([500], {'sheets': [{'properties': {'title': 'Hoja 1',
+                                                                'gridProperties': {'rowCount': 10}}}]})
+
+    revision = SheetsGridRevisionSource(GridSheetsService(request)).get_revision('file')
+
+    assert revision is not None
+    assert request.calls == 2
@@ -0,0 +1,77 @@
+import pyarrow as pa
+
+from etl.google_sheets.snapshot_cache import PageSnapshotCache
+from etl.google_sheets.google_sheets_extractor import GoogleSheetsExtractor
+from tests.fakes import (HEADER, TYPED_VALUES, RowsSheetsService, TypedSheetsService,
+                         build_file, build_row, build_watermark)
+
+
+def test_snapshot_is_loaded_as_arrow_columns(tmp_path):
+    cache = PageSnapshotCache(str(tmp_path), 1024 ** 2)
+    cache.store('file', 'Hoja 1', 'rev', [['Marca temporal', 'a', 'b'], ['Puntuación', '1']])
+
+    columns = cache.load_latest('file', 'Hoja 1')
+
+    assert all(isinstance(column, pa.Array) and column.type == pa.large_string() for column in columns)
+    assert [column.to_pylist() for column in columns] == [['Marca temporal', 'a', 'b'],
+                                                          ['Puntuación', '1', None]]
+
+
+def test_typed_snapshot_replays_like_the_fetch(tmp_path):
+    extractor = GoogleSheetsExtractor(None, TypedSheetsService())
+    google_sheets_file, page = build_file(typed_fetch=True)
+    cache = PageSnapshotCache(str(tmp_path), 1024 ** 2)
+    cache.store('file', page.title, 'rev', TYPED_VALUES)
+
+    fetched = extractor._generate_lazyframe(TYPED_VALUES, google_sheets_file, page).collect()
+    replayed = extractor._generate_lazyframe_from_snapshot(cache.load_latest('file', page.title),
+                                                           google_sheets_file, page).collect()
+
+    assert replayed.schema == fetched.schema
+    assert replayed.to_dicts() == fetched.to_dicts()
+
+
+def test_snapshot_series_share_the_memory_mapped_buffers(tmp_path):
+    extractor = GoogleSheetsExtractor(None, TypedSheetsService())
+    google_sheets_file, _ = build_file(typed_fetch=True)
+    cache = PageSnapshotCache(str(tmp_path), 1024 ** 2)
+    cache.store('file', 'Hoja 1', 'rev', TYPED_VALUES)
+    columns = cache.load_latest('file', 'Hoja 1')
+
+    series = extractor._arrow_series([column[0].as_py() for column in columns],
+                                     [column.slice(1) for column in columns], google_sheets_file)
+
+    for column, column_series in zip(columns, series):
+        assert [buffer.address for buffer in column_series.to_arrow().buffers()[1:]] == \
+            [buffer.address for buffer in column.buffers()[1:]]
+
+
+def test_tail_fetch_appends_to_the_latest_snapshot(tmp_path):
+    service = RowsSheetsService([build_row(day) for day in range(1, 8)])
+    extractor = GoogleSheetsExtractor(None, service)
+    extractor.FETCH_MODE = 'single'
+    extractor.TAIL_FETCH_OVERLAP = 2
+    extractor.snapshot_cache = PageSnapshotCache(str(tmp_path), 1024 ** 2)
+    google_sheets_file, page = build_file(build_watermark(extractor, row_cursor=6))
+    # the snapshot of the last full fetch, when rows 2 to 6 were loaded
+    extractor.snapshot_cache.store('file', page.title, '6-rev', [list(column) for column in
+                                                                 zip(HEADER, *[build_row(day) for day in range(1, 6)])])
+
+    next(extractor._iter_excel_values(google_sheets_file, [page]))
+
+    columns = extractor.snapshot_cache.load_latest('file', page.title)
+    assert service.ranges == ['Hoja 1!A1:G1', 'Hoja 1!A5:G']
+    assert columns[0].to_pylist() == ['Marca temporal'] + [f'{day:02d}/07/2023 10:00:00' for day in range(1, 8)]
+
+
+def test_tail_fetch_without_snapshot_fetches_the_full_range(tmp_path):
+    service = RowsSheetsService([build_row(day) for day in range(1, 8)])
+    extractor = GoogleSheetsExtractor(None, service)
+    extractor.FETCH_MODE = 'single'
+    extractor.snapshot_cache = PageSnapshotCache(str(tmp_path), 1024 ** 2)
+    google_sheets_file, page = build_file(build_watermark(extractor, row_cursor=6))
+
+    next(extractor._iter_excel_values(google_sheets_file, [page]))
+
+    assert service.ranges[-1] == 'Hoja 1!A:G'
+    assert len(extractor.snapshot_cache.load_latest('file', page.title)[0]) == 8
@@ -0,0 +1,61 @@
+from etl.google_sheets.google_sheets_extractor import GoogleSheetsExtractor
+from tests.fakes import RowsSheetsService, build_file, build_row, build_watermark
+
+
+def fetch_page(service: RowsSheetsService, overlap: int) -> tuple[list[list[str]], tuple[int, str]]:
+    extractor = GoogleSheetsExtractor(None, service)
+    extractor.FETCH_MODE = 'single'
+    extractor.TAIL_FETCH_OVERLAP = overlap
+    google_sheets_file, page = build_file(build_watermark(extractor, row_cursor=6))
+    return next(extractor._iter_excel_values(google_sheets_file, [page]))
+
+
+def test_tail_is_stitched_onto_the_header():
+    # rows 2 to 6 were loaded, the watermark is the 5th of July
+    service = RowsSheetsService([build_row(day) for day in range(1, 8)])
+
+    values, row_cursor = fetch_page(service, overlap=2)
+
+    assert service.ranges == ['Hoja 1!A1:G1', 'Hoja 1!A5:G']
+    assert values[0] == ['Marca temporal', '04/07/2023 10:00:00', '05/07/2023 10:00:00',
+                         '06/07/2023 10:00:00', '07/07/2023 10:00:00']
+    assert row_cursor[0] == 8
+
+
+def test_idle_page_without_overlap_keeps_the_tail():
+    service = RowsSheetsService([build_row(day) for day in range(1, 6)])
+
+    values, row_cursor = fetch_page(service, overlap=0)
+
+    assert service.ranges == ['Hoja 1!A1:G1', 'Hoja 1!A6:G']
+    assert values[0] == ['Marca temporal', '05/07/2023 10:00:00']
+    assert row_cursor[0] == 6
+
+
+def test_deleted_rows_fall_back_to_the_full_range():
+    # three loaded rows were deleted and new rows moved above the tail
+    service = RowsSheetsService([build_row(day) for day in (1, 2)] + [build_row(day) for day in range(6, 10)])
+
+    values, row_cursor = fetch_page(service, overlap=0)
+
+    assert service.ranges == ['Hoja 1!A1:G1', 'Hoja 1!A6:G', 'Hoja 1!A:G']
+    assert values[0][1:] == [f'{day:02d}/07/2023 10:00:00' for day in (1, 2, 6, 7, 8, 9)]
+    assert row_cursor[0] == 7
+
+
+def test_deleted_rows_shard_the_page_from_the_first_row():
+    service = RowsSheetsService([build_row(day) for day in (1, 2)] + [build_row(day) for day in range(6, 10)])
+    extractor = GoogleSheetsExtractor(None, service)
+    extractor.TAIL_FETCH_OVERLAP = 0
+    extractor.SHARD_ROWS = 2
+    extractor.SHARD_WORKERS = 1
+    google_sheets_file, page = build_file(build_watermark(extractor, row_cursor=6))
+    page.row_count = len(service.rows) + 1
+    written = []
+    extractor._write = lambda google_sheets_file, df, row_cursors: written.append((df, row_cursors))
+
+    extractor._execute_sharded_page(google_sheets_file, page, None)
+
+    loaded = [df for df, _ in written if df is not None]
+    assert [row.day for df in loaded for row in df['marca_temporal']] == [6, 7, 8, 9]
+    assert written[-1][1]['Hoja 1'][0] == 7
@@ -0,0 +1,31 @@
+from datetime import datetime as dt
+
+import polars as pl
+
+from etl.google_sheets.google_sheets_extractor import GoogleSheetsExtractor
+from tests.fakes import TYPED_VALUES, TypedSheetsService, build_file
+
+
+def test_typed_payload_goes_through_get_range_values():
+    service = TypedSheetsService()
+    extractor = GoogleSheetsExtractor(None, service)
+
+    values = extractor._get_range_values('file', 'Hoja 1!A:G', typed=True)
+
+    assert values == TYPED_VALUES
+    assert service.requests[0]['valueRenderOption'] == 'UNFORMATTED_VALUE'
+    assert service.requests[0]['dateTimeRenderOption'] == 'SERIAL_NUMBER'
+
+
+def test_typed_payload_is_transformed():
+    extractor = GoogleSheetsExtractor(None, TypedSheetsService())
+    google_sheets_file, page = build_file(typed_fetch=True)
+
+    values = extractor._get_range_values('file', page.get_full_range(), typed=True)
+    df = extractor._generate_lazyframe(values, google_sheets_file, page).collect()
+
+    assert df['marca_temporal'].to_list() == [dt(2023, 7, 16, 12), dt(2023, 7, 17, 6)]
+    assert df['puntuacion'].to_list() == [15, 9]
+    assert df['dni'].to_list() == ['12345678', '87654321']
+    assert df['estado'].to_list() == ['APROBADO', 'DESAPROBADO']
+    assert df.schema['marca_temporal'] == pl.Datetime('us')
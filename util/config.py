@@ -0,0 +1,26 @@
+import os
+import json
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_UNSET = object()
+
+class EnvJson():
+    """Class attribute parsed from a JSON environment variable on first access
+    instead of at import time"""
+
+    def __init__(self, name: str, default: str=None) -> None:
+        self.name = name
+        self.default = default
+        self._value = _UNSET
+
+    def __get__(self, obj, owner):
+        if self._value is _UNSET:
+            raw = os.environ[self.name] if self.default is None else os.getenv(self.name, self.default)
+            self._value = json.loads(raw)
+        return self._value
+
+
+class Config():
+    GOOGLE_SHEETS_CONFIG = EnvJson('GOOGLE_SHEETS_CONFIG')
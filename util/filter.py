@@ -1,5 +1,4 @@
 import os
-import json
 import abc
 from dotenv import load_dotenv
 
@@ -7,6 +6,7 @@ from datetime import datetime as dt, timedelta
 import polars as pl
 
 from constant.enum import Mode
+from util.config import EnvJson
 
 load_dotenv()
 
@@ -24,11 +24,21 @@ class LastRecordedValue(FilterValue):
         self.emails = emails
 
 
+class Watermark(LastRecordedValue):
+
+    def __init__(self, datetime_to_filter_by: dt, page: str, emails: list[str],
+                 row_cursor: int=None, header_hash: str=None):
+        super().__init__(datetime_to_filter_by, page, emails)
+        self.row_cursor = row_cursor
+        self.header_hash = header_hash
+
+
 class DateTimeFilter(metaclass=abc.ABCMeta):
-    EXTRACTION_INTERVAL = json.loads(os.environ['EXTRACTION_INTERVAL'])
+    EXTRACTION_INTERVAL = EnvJson('EXTRACTION_INTERVAL')
     FIXED_MODE = os.getenv('FIXED_MODE', '')
 
-    def filter(self, df: pl.DataFrame, filter_value: FilterValue=None, mode: Mode=None) -> pl.DataFrame:
+    def filter(self, df: pl.DataFrame | pl.LazyFrame, filter_value: FilterValue=None,
+               mode: Mode=None) -> pl.DataFrame | pl.LazyFrame:
         if self.FIXED_MODE:
             mode = Mode[self.FIXED_MODE]
 
@@ -44,7 +54,8 @@ class DateTimeFilter(metaclass=abc.ABCMeta):
             return df
         
     @abc.abstractmethod
-    def _custom_filter(self, df: pl.DataFrame, filter_value: FilterValue) -> pl.DataFrame:
+    def _custom_filter(self, df: pl.DataFrame | pl.LazyFrame,
+                       filter_value: FilterValue) -> pl.DataFrame | pl.LazyFrame:
         raise NotImplementedError
     
 
@@ -96,4 +107,18 @@ class DateTimeFilterByLastRecordedValue(DateTimeFilter):
             .and_(pl.col('pestania').eq(filter_value.page))
             .and_(pl.col('correo').is_in(filter_value.emails).not_())
         )
-    
\ No newline at end of file
+
+
+class DateTimeFilterByLookback(DateTimeFilter):
+    """Keeps the rows of the page recorded from lookback before the last recorded
+    value onwards. Meant to be followed by a deduplication against the rows
+    already loaded, such as the fingerprint anti join"""
+
+    def __init__(self, lookback: timedelta):
+        self.lookback = lookback
+
+    def _custom_filter(self, df: pl.DataFrame | pl.LazyFrame, filter_value: LastRecordedValue):
+        return df.filter(
+            pl.col('marca_temporal').ge(filter_value.datetime_to_filter_by - self.lookback)
+            .and_(pl.col('pestania').eq(filter_value.page))
+        )
@@ -1,13 +1,22 @@
-from util.filter import LastRecordedValue
+import os
+import json
+import logging
+from dotenv import load_dotenv
+
+import polars as pl
+
+from util.filter import LastRecordedValue, Watermark
 from datasource.connection_wrapper import SQLAlchemyConnectionWrapper
 
+load_dotenv()
+
 class FilterStrategy():
     pass
     
 class FilterByLastRecordedValueStrategy(FilterStrategy):
 
     @classmethod
-    def get_filter_value(cls, conn: SQLAlchemyConnectionWrapper, table: str) -> list[LastRecordedValue]:
+    def get_filter_value(cls, conn: SQLAlchemyConnectionWrapper, table: str) -> dict[str, LastRecordedValue]:
         filter_values = conn.execute(cls._query(table)).fetchall()
         page_emails = {}
         page_datetime = {}
@@ -21,12 +30,12 @@ class FilterByLastRecordedValueStrategy(FilterStrategy):
             if filter_value[1] not in page_datetime.keys():
                 page_datetime[filter_value[1]] = filter_value[0]
 
-        return [LastRecordedValue(page_datetime[key], key, page_emails[key])
-                for key in page_emails.keys()]
+        return {key: LastRecordedValue(page_datetime[key], key, page_emails[key])
+                for key in page_emails.keys()}
 
     @classmethod
-    def get_filter_value_by_page(cls, filter_values: list[LastRecordedValue], page: str):
-        return next((filter_value for filter_value in filter_values if filter_value.page == page))
+    def get_filter_value_by_page(cls, filter_values: dict[str, LastRecordedValue], page: str):
+        return filter_values.get(page)
 
     @classmethod
     def _query(cls, db_table: str):
@@ -48,4 +57,153 @@ class FilterByLastRecordedValueStrategy(FilterStrategy):
         {db_table} AS t2
         ON t2.pestania = t1.pestania
         AND t2.marca_temporal = t1.ultima_fecha;
-    """
\ No newline at end of file
+    """
+
+class FilterByWatermarkStrategy(FilterByLastRecordedValueStrategy):
+    """Keeps the last recorded value of every page in a small state table so it
+    can be read for all tables in one query instead of scanning each table"""
+
+    ENABLED = os.getenv('FILTER_STRATEGY', 'watermark') == 'watermark'
+    TABLE = os.getenv('WATERMARK_TABLE', 'etl_watermark')
+
+    @classmethod
+    def create_table(cls, conn: SQLAlchemyConnectionWrapper) -> None:
+        conn.execute(cls._create_table_query())
+        conn.commit()
+
+    @classmethod
+    def table_exists(cls, conn: SQLAlchemyConnectionWrapper) -> bool:
+        return conn.execute(f"SHOW TABLES LIKE '{cls.TABLE}'").fetchone() is not None
+
+    @classmethod
+    def get_filter_values(cls, conn: SQLAlchemyConnectionWrapper, tables: list[str],
+                          seed: bool=True) -> dict[str, dict[str, LastRecordedValue]]:
+        """Returns the watermark of every page of every table, keyed by table and page.
+        Tables without any watermark are seeded from their data first. Without seed
+        nothing is written, their last recorded values are read from the data
+        and the table may not exist yet"""
+        filter_values = {table: {} for table in tables}
+
+        if len(tables) == 0:
+            return filter_values
+
+        rows = (conn.execute(cls._select_query(tables)).fetchall()
+                if seed or cls.table_exists(conn) else [])
+        for db_table, page, datetime_to_filter_by, emails, row_cursor, header_hash in rows:
+            filter_values[db_table][page] = Watermark(
+                datetime_to_filter_by, page, json.loads(emails), row_cursor, header_hash
+            )
+
+        for table in tables:
+            if len(filter_values[table]) == 0:
+                filter_values[table] = (cls.rebuild(conn, table) if seed
+                                        else cls.get_filter_value(conn, table))
+
+        return filter_values
+
+    @classmethod
+    def rebuild(cls, conn: SQLAlchemyConnectionWrapper, db_table: str) -> dict[str, LastRecordedValue]:
+        """Seeds the watermarks of db_table from the data already loaded in it"""
+        filter_values = cls.get_filter_value(conn, db_table)
+        conn.execute(f"DELETE FROM {cls.TABLE} WHERE db_table = :db_table", {'db_table': db_table})
+        if len(filter_values) > 0:
+            conn.execute(cls._replace_query(), [
+                {'db_table': db_table,
+                 'pestania': filter_value.page,
+                 'marca_temporal': filter_value.datetime_to_filter_by,
+                 'correos': json.dumps(filter_value.emails)}
+                for filter_value in filter_values.values()
+            ])
+        conn.commit()
+        logging.info(f"{cls.__name__} - Watermarks rebuilt for table '{db_table}'. {len(filter_values)} pages")
+        return filter_values
+
+    @classmethod
+    def update(cls, conn: SQLAlchemyConnectionWrapper, db_table: str, df: pl.DataFrame) -> None:
+        """Advances the watermarks of db_table with the rows of df.
+        Meant to run in the same transaction as the insert of df"""
+        last_rows = cls.get_last_rows(df)
+
+        if last_rows.is_empty():
+            return
+
+        conn.execute(cls._upsert_query(), [
+            {'db_table': db_table,
+             'pestania': row['pestania'],
+             'marca_temporal': row['marca_temporal'],
+             'correos': json.dumps(row['correo'])}
+            for row in last_rows.iter_rows(named=True)
+        ])
+
+    @classmethod
+    def get_last_rows(cls, df: pl.DataFrame) -> pl.DataFrame:
+        """Returns, per page, the last marca_temporal of df and the emails recorded at it"""
+        return (df.filter(pl.col('marca_temporal').is_not_null()
+                          & (pl.col('marca_temporal') == pl.col('marca_temporal').max().over('pestania')))
+                  .group_by('pestania')
+                  .agg(pl.col('marca_temporal').first(), pl.col('correo').unique()))
+
+    @classmethod
+    def update_row_cursors(cls, conn: SQLAlchemyConnectionWrapper, db_table: str,
+                           row_cursors: dict[str, tuple[int, str]]) -> None:
+        """Stores, per page, the last sheet row consumed and the hash of its header row"""
+        if len(row_cursors) == 0:
+            return
+
+        conn.execute(cls._update_row_cursor_query(), [
+            {'db_table': db_table, 'pestania': page, 'filas': row_cursor, 'encabezado_hash': header_hash}
+            for page, (row_cursor, header_hash) in row_cursors.items()
+        ])
+
+    @classmethod
+    def _create_table_query(cls):
+        return \
+    f"""CREATE TABLE IF NOT EXISTS {cls.TABLE} (
+        db_table VARCHAR(64) NOT NULL,
+        pestania VARCHAR(255) NOT NULL,
+        marca_temporal DATETIME NOT NULL,
+        correos JSON NOT NULL,
+        filas INT NULL,
+        encabezado_hash CHAR(40) NULL,
+        PRIMARY KEY (db_table, pestania)
+    );
+    """
+
+    @classmethod
+    def _select_query(cls, tables: list[str]):
+        table_list = ', '.join(f"'{table}'" for table in tables)
+        return \
+    f"""SELECT db_table, pestania, marca_temporal, correos, filas, encabezado_hash
+    FROM {cls.TABLE}
+    WHERE db_table IN ({table_list});
+    """
+
+    @classmethod
+    def _replace_query(cls):
+        return \
+    f"""REPLACE INTO {cls.TABLE} (db_table, pestania, marca_temporal, correos)
+    VALUES (:db_table, :pestania, :marca_temporal, :correos);
+    """
+
+    @classmethod
+    def _update_row_cursor_query(cls):
+        return \
+    f"""UPDATE {cls.TABLE}
+    SET filas = :filas, encabezado_hash = :encabezado_hash
+    WHERE db_table = :db_table AND pestania = :pestania;
+    """
+
+    @classmethod
+    def _upsert_query(cls):
+        # correos is assigned first so the comparisons still see the stored marca_temporal
+        return \
+    f"""INSERT INTO {cls.TABLE} (db_table, pestania, marca_temporal, correos)
+    VALUES (:db_table, :pestania, :marca_temporal, :correos)
+    ON DUPLICATE KEY UPDATE
+        correos = CASE
+            WHEN VALUES(marca_temporal) = marca_temporal THEN JSON_MERGE_PRESERVE(correos, VALUES(correos))
+            WHEN VALUES(marca_temporal) > marca_temporal THEN VALUES(correos)
+            ELSE correos
+        END,
+        marca_temporal = GREATEST(marca_temporal, VALUES(marca_temporal));
+    """
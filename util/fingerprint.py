@@ -0,0 +1,75 @@
+import os
+import json
+import hashlib
+from dotenv import load_dotenv
+
+from datetime import timedelta
+import polars as pl
+
+from util.filter import LastRecordedValue
+from datasource.connection_wrapper import SQLAlchemyConnectionWrapper
+
+load_dotenv()
+
+class RowFingerprint():
+    """Deterministic per row hash of page, timestamp, email and answers, stored
+    in the COLUMN of tables that define it. Hashes are the first 8 bytes of the
+    SHA-1 digest of the joined values, stable across polars versions and hosts.
+    Rows loaded before the COLUMN existed have no fingerprint, pages with such
+    rows within LOOKBACK are not covered and keep the last recorded value filter"""
+
+    COLUMN = 'huella'
+    LOOKBACK = timedelta(**json.loads(os.getenv('FINGERPRINT_LOOKBACK', '{"days": 1}')))
+    SEPARATOR = '\x1f'
+
+    @classmethod
+    def expr(cls, columns: list[str]) -> pl.Expr:
+        return (pl.concat_str([pl.col(column).cast(pl.Utf8).fill_null('') for column in columns],
+                              separator=cls.SEPARATOR)
+                .map_elements(cls.digest, return_dtype=pl.UInt64)
+                .alias(cls.COLUMN))
+
+    @classmethod
+    def digest(cls, value: str) -> int:
+        return int.from_bytes(hashlib.sha1(value.encode('utf-8')).digest()[:8], 'big')
+
+    @classmethod
+    def get_recent(cls, conn: SQLAlchemyConnectionWrapper, db_table: str,
+                   filter_values: list[LastRecordedValue]) -> pl.DataFrame:
+        """Returns the fingerprints stored within LOOKBACK of the last recorded
+        value of every given page, in a single query"""
+        schema = {'pestania': pl.Utf8, cls.COLUMN: pl.UInt64}
+
+        if len(filter_values) == 0:
+            return pl.DataFrame(schema=schema)
+
+        params = {}
+        for idx, filter_value in enumerate(filter_values):
+            params[f'pestania_{idx}'] = filter_value.page
+            params[f'desde_{idx}'] = filter_value.datetime_to_filter_by - cls.LOOKBACK
+
+        rows = conn.execute(cls._recent_query(db_table, len(filter_values)), params).fetchall()
+        return pl.DataFrame([tuple(row) for row in rows], schema=schema, orient='row')
+
+    @classmethod
+    def covers(cls, recent: pl.DataFrame, page: str) -> bool:
+        """Whether every recent row of the page has a fingerprint"""
+        return recent.filter((pl.col('pestania') == page) & pl.col(cls.COLUMN).is_null()).height == 0
+
+    @classmethod
+    def anti_join(cls, lf: pl.LazyFrame, recent: pl.DataFrame, page: str) -> pl.LazyFrame:
+        seen = (recent.lazy()
+                      .filter((pl.col('pestania') == page) & pl.col(cls.COLUMN).is_not_null())
+                      .select(cls.COLUMN))
+        return (lf.unique(subset=[cls.COLUMN], keep='first', maintain_order=True)
+                  .join(seen, on=cls.COLUMN, how='anti'))
+
+    @classmethod
+    def _recent_query(cls, db_table: str, pages: int):
+        conditions = ' OR '.join(f'(pestania = :pestania_{idx} AND marca_temporal >= :desde_{idx})'
+                                 for idx in range(pages))
+        return \
+    f"""SELECT pestania, {cls.COLUMN}
+    FROM {db_table}
+    WHERE {conditions};
+    """
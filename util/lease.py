@@ -0,0 +1,129 @@
+import os
+from dotenv import load_dotenv
+
+from datasource.connection_wrapper import SQLAlchemyConnectionWrapper
+
+load_dotenv()
+
+class TableLease():
+    """Leases of destination tables shared by the workers of several processes or
+    hosts through the TABLE of the same database. A lease is held by one owner
+    until it expires, it is renewed with heartbeats and can be claimed by anyone
+    once expired, so the tables of a dead worker are reclaimed. Tables completed
+    within the refresh interval are not claimed again. Expiry is computed with
+    the database clock so hosts don't need synchronized clocks"""
+
+    TABLE = os.getenv('LEASE_TABLE', 'etl_lease')
+
+    @classmethod
+    def create_table(cls, conn: SQLAlchemyConnectionWrapper) -> None:
+        conn.execute(cls._create_table_query())
+        conn.commit()
+
+    @classmethod
+    def claim(cls, conn: SQLAlchemyConnectionWrapper, db_table: str, owner: str,
+              lease_seconds: int, refresh_seconds: int) -> bool:
+        """Meant to run in its own transaction"""
+        params = {'db_table': db_table, 'owner': owner, 'seconds': lease_seconds, 'refresh': refresh_seconds}
+        conn.execute(cls._claim_query(), params)
+        row = conn.execute(cls._owner_query(), params).fetchone()
+        return row is not None and row[0] == owner
+
+    @classmethod
+    def heartbeat(cls, conn: SQLAlchemyConnectionWrapper, db_table: str, owner: str,
+                  lease_seconds: int) -> bool:
+        """Extends a lease still held by owner. Returns False once it was lost"""
+        result = conn.execute(cls._heartbeat_query(),
+                              {'db_table': db_table, 'owner': owner, 'seconds': lease_seconds})
+        return result.rowcount > 0
+
+    @classmethod
+    def is_held(cls, conn: SQLAlchemyConnectionWrapper, db_table: str, owner: str) -> bool:
+        """Locks the lease row until the end of the transaction, so it can't be
+        reclaimed while the caller writes under it"""
+        row = conn.execute(cls._held_query(), {'db_table': db_table}).fetchone()
+        return row is not None and row[0] == owner and bool(row[1])
+
+    @classmethod
+    def release(cls, conn: SQLAlchemyConnectionWrapper, db_table: str, owner: str, completed: bool) -> None:
+        conn.execute(cls._release_query(), {'db_table': db_table, 'owner': owner, 'completed': completed})
+
+    @classmethod
+    def get_completed(cls, conn: SQLAlchemyConnectionWrapper, db_tables: list[str],
+                      refresh_seconds: int) -> set[str]:
+        if len(db_tables) == 0:
+            return set()
+        rows = conn.execute(cls._completed_query(db_tables), {'refresh': refresh_seconds}).fetchall()
+        return {row[0] for row in rows}
+
+    @classmethod
+    def _create_table_query(cls):
+        return \
+    f"""CREATE TABLE IF NOT EXISTS {cls.TABLE} (
+        db_table VARCHAR(64) NOT NULL,
+        owner VARCHAR(255) NULL,
+        expires_at DATETIME NOT NULL,
+        heartbeat_at DATETIME NULL,
+        completed_at DATETIME NULL,
+        PRIMARY KEY (db_table)
+    );
+    """
+
+    @classmethod
+    def _claim_query(cls):
+        # owner is assigned first, the following assignments see whether the claim succeeded
+        return \
+    f"""INSERT INTO {cls.TABLE} (db_table, owner, expires_at, heartbeat_at)
+    VALUES (:db_table, :owner, NOW() + INTERVAL :seconds SECOND, NOW())
+    ON DUPLICATE KEY UPDATE
+        owner = IF(expires_at < NOW()
+                   AND (completed_at IS NULL OR completed_at < NOW() - INTERVAL :refresh SECOND),
+                   VALUES(owner), owner),
+        expires_at = IF(owner <=> VALUES(owner), VALUES(expires_at), expires_at),
+        heartbeat_at = IF(owner <=> VALUES(owner), VALUES(heartbeat_at), heartbeat_at);
+    """
+
+    @classmethod
+    def _owner_query(cls):
+        return \
+    f"""SELECT owner
+    FROM {cls.TABLE}
+    WHERE db_table = :db_table;
+    """
+
+    @classmethod
+    def _heartbeat_query(cls):
+        return \
+    f"""UPDATE {cls.TABLE}
+    SET expires_at = NOW() + INTERVAL :seconds SECOND, heartbeat_at = NOW()
+    WHERE db_table = :db_table AND owner = :owner AND expires_at >= NOW();
+    """
+
+    @classmethod
+    def _held_query(cls):
+        return \
+    f"""SELECT owner, expires_at >= NOW()
+    FROM {cls.TABLE}
+    WHERE db_table = :db_table
+    FOR UPDATE;
+    """
+
+    @classmethod
+    def _release_query(cls):
+        return \
+    f"""UPDATE {cls.TABLE}
+    SET owner = NULL,
+        expires_at = NOW(),
+        completed_at = IF(:completed, NOW(), completed_at)
+    WHERE db_table = :db_table AND owner = :owner;
+    """
+
+    @classmethod
+    def _completed_query(cls, tables: list[str]):
+        table_list = ', '.join(f"'{table}'" for table in tables)
+        return \
+    f"""SELECT db_table
+    FROM {cls.TABLE}
+    WHERE db_table IN ({table_list})
+        AND completed_at >= NOW() - INTERVAL :refresh SECOND;
+    """
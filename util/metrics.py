@@ -0,0 +1,149 @@
+import os
+import abc
+import json
+import time
+import logging
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+
+class StageHook(metaclass=abc.ABCMeta):
+    """Receives the start and end of every instrumented stage. Hooks run in the
+    thread executing the stage"""
+
+    @abc.abstractmethod
+    def on_start(self, stage: str, labels: dict) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def on_end(self, stage: str, labels: dict, record: dict) -> None:
+        raise NotImplementedError
+
+    @classmethod
+    def __subclasshook__(cls, subclass):
+        return (hasattr(subclass, 'on_start') and
+                callable(subclass.on_start) and
+                hasattr(subclass, 'on_end') and
+                callable(subclass.on_end) or
+                NotImplemented)
+
+
+class ProfilerHook(StageHook):
+    """Profiles every run of a single stage with cProfile and dumps the
+    accumulated stats to output_path"""
+
+    def __init__(self, stage: str, output_path: str):
+        self.stage = stage
+        self.output_path = output_path
+        self._stats: pstats.Stats = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def on_start(self, stage: str, labels: dict) -> None:
+        if stage != self.stage:
+            return
+        self._local.profiler = cProfile.Profile()
+        self._local.profiler.enable()
+
+    def on_end(self, stage: str, labels: dict, record: dict) -> None:
+        if stage != self.stage:
+            return
+        self._local.profiler.disable()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(self._local.profiler)
+            else:
+                self._stats.add(self._local.profiler)
+            self._stats.dump_stats(self.output_path)
+
+
+class Metrics():
+    """Times the stages of a run and aggregates their durations, rows and bytes
+    per stage and per file. Every stage is also logged as a structured record"""
+
+    def __init__(self) -> None:
+        self.hooks: list[StageHook] = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages = defaultdict(lambda: {'count': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0})
+            self._files = defaultdict(lambda: defaultdict(lambda: {'count': 0, 'seconds': 0.0,
+                                                                   'rows': 0, 'bytes': 0}))
+
+    def add_hook(self, hook: StageHook) -> None:
+        self.hooks.append(hook)
+
+    @contextmanager
+    def stage(self, stage: str, **labels):
+        """Times the wrapped block. The yielded dict can be filled with the rows
+        and bytes processed by the stage"""
+        stats = {'rows': 0, 'bytes': 0}
+        for hook in self.hooks:
+            hook.on_start(stage, labels)
+
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            record = {'stage': stage, **labels, 'seconds': time.perf_counter() - start, **stats}
+            self._record(record)
+            for hook in self.hooks:
+                hook.on_end(stage, labels, record)
+
+    def _record(self, record: dict) -> None:
+        with self._lock:
+            aggregates = [self._stages[record['stage']]]
+            if 'file' in record:
+                aggregates.append(self._files[record['file']][record['stage']])
+            for aggregate in aggregates:
+                aggregate['count'] += 1
+                aggregate['seconds'] += record['seconds']
+                aggregate['rows'] += record['rows']
+                aggregate['bytes'] += record['bytes']
+
+        logging.info(f"metrics - Stage '{record['stage']}' took {record['seconds']:.3f}s",
+                     extra={'json_fields': record})
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {'stages': {stage: dict(aggregate) for stage, aggregate in self._stages.items()},
+                    'files': {file: {stage: dict(aggregate) for stage, aggregate in stages.items()}
+                              for file, stages in self._files.items()}}
+
+    def write_json(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_prometheus(self, path: str) -> None:
+        """Writes the per stage aggregates in the node exporter textfile format"""
+        lines = []
+        for metric, key, help in (('forms_etl_stage_seconds_total', 'seconds', 'Time spent per stage'),
+                                  ('forms_etl_stage_runs_total', 'count', 'Runs per stage'),
+                                  ('forms_etl_stage_rows_total', 'rows', 'Rows processed per stage'),
+                                  ('forms_etl_stage_bytes_total', 'bytes', 'Bytes processed per stage')):
+            lines.append(f'# HELP {metric} {help}')
+            lines.append(f'# TYPE {metric} counter')
+            for stage, aggregate in self.summary()['stages'].items():
+                lines.append(f'{metric}{{stage="{stage}"}} {aggregate[key]}')
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+
+def values_size(values: list[list[str]]) -> tuple[int, int]:
+    """Returns the rows, without header, and the characters of columnar values.
+    Unformatted numbers of typed fetches are measured by their string form"""
+    rows = max((len(column) for column in values), default=1) - 1
+    size = sum(len(value) if isinstance(value, str) else len(str(value))
+               for column in values for value in column if value is not None)
+    return max(rows, 0), size
+
+
+metrics = Metrics()
@@ -0,0 +1,69 @@
+import threading
+import time
+
+
+class TokenBucketRateLimiter():
+    """Thread safe token bucket. Tokens are refilled continuously at
+    rate_per_minute and at most capacity tokens can be accumulated"""
+
+    def __init__(self, rate_per_minute: float, capacity: int=None) -> None:
+        self.rate_per_second = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else max(1, int(rate_per_minute))
+        self._tokens = float(self.capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int=1) -> None:
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate_per_second
+            time.sleep(wait)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last_refill) * self.rate_per_second)
+        self._last_refill = now
+
+
+class AdaptiveConcurrencyLimiter():
+    """Bounds the number of in flight requests. The limit is halved every time
+    the API throttles us and grows back by one after success_threshold
+    consecutive successful requests"""
+
+    def __init__(self, max_limit: int, success_threshold: int=10) -> None:
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.success_threshold = success_threshold
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.success_threshold and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def on_throttle(self) -> None:
+        with self._condition:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0